@@ -0,0 +1,295 @@
+"""
+
+    Offline evaluation of recommendation quality and throughput.
+
+    Author: Explore Data Science Academy.
+
+    Description: Splits the ratings in time: everything rated before a
+    cut-off timestamp is history, and each user's later ratings of at
+    least `RELEVANT_RATING` are the movies they went on to like. Every
+    user with both is given their highest-rated (most recent on ties)
+    history movies as favourites, and the recommenders are scored on how
+    many of the later liked movies they recommend:
+
+    - precision@k and recall@k,
+    - NDCG@k (binary relevance),
+    - coverage: the share of the catalogue recommended to anyone.
+
+    `content` and `collab` evaluate the app's `content_model` and
+    `collab_model` as deployed. Note that the deployed SVD model may have
+    been trained on ratings after the cut-off, which flatters `collab`.
+    `svd` trains a fresh SVD on the history only (with
+    `train_colbased.svd_from_matrix`) and ranks every unseen movie for a
+    batch of users with one matrix product, giving a leak-free baseline.
+
+    Users are scored in batches spread over a pool of worker processes,
+    and the throughput of each algorithm (users per second) is reported
+    next to its quality, so speed changes can be checked against their
+    effect on recommendations.
+
+    Usage (from the root of the repository):
+
+        python -m benchmarks.evaluate
+        python -m benchmarks.evaluate --algorithms svd collab --max-users 2000
+
+"""
+# Script dependencies
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from utils.data_loader import load_rating_arrays, load_title_index
+from utils.rating_matrix import build_rating_matrix, user_rows
+
+ALGORITHMS = ['content', 'collab', 'svd']
+# A later rating at least this high marks a movie the user liked
+RELEVANT_RATING = 4.0
+# Number of history movies given to the recommenders as favourites
+N_FAVOURITES = 3
+# Hyperparameters of the SVD trained on the history
+SVD_PARAMS = {'n_factors': 100, 'n_epochs': 20, 'lr_all': 0.005,
+              'reg_all': 0.02, 'init_std_dev': 0.05}
+TRAIN_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            'resources', 'models', 'train_colbased.py')
+
+# State shared with worker processes. Under the 'fork' start method
+# workers inherit it copy-on-write instead of receiving a copy.
+_split = None
+
+
+def temporal_split(ratings, test_fraction=0.2, max_users=None, seed=0,
+                   catalogue_ids=None):
+    """Split ratings at a timestamp and pick the users to evaluate.
+
+    Parameters
+    ----------
+    ratings : dict or Pandas Dataframe
+        `userId`, `movieId`, `rating` and `timestamp` of every rating.
+    test_fraction : float
+        Share of the ratings, the latest ones, held out.
+    max_users : int, optional
+        Evaluate a random sample of at most this many users.
+    seed : int
+        Seed of the user sample.
+    catalogue_ids : array-like (int), optional
+        Movie IDs the recommenders can take as favourites (those in
+        `movies.csv`); rated movies outside it are never favourites.
+
+    Returns
+    -------
+    dict
+        `history`: the ratings before the cut-off, as a Dataframe;
+        `users`: the evaluated MovieLens User IDs; `favourites`: a list
+        of favourite Movie IDs per user; `relevant`: a list of liked
+        later Movie IDs per user; the `cutoff` timestamp; and the number
+        of users `skipped` for having no favourite in the catalogue.
+
+    """
+    ratings = pd.DataFrame({name: ratings[name] for name in
+                            ['userId', 'movieId', 'rating', 'timestamp']})
+    cutoff = np.quantile(ratings['timestamp'], 1 - test_fraction)
+    history = ratings[ratings['timestamp'] < cutoff]
+    later = ratings[(ratings['timestamp'] >= cutoff)
+                    & (ratings['rating'] >= RELEVANT_RATING)]
+    candidates = history
+    if catalogue_ids is not None:
+        candidates = history[history['movieId'].isin(catalogue_ids)]
+    # Highest-rated history movies of each user, most recent first on ties
+    favourites = (candidates.sort_values(['userId', 'rating', 'timestamp'],
+                                         ascending=[True, False, False])
+                            .groupby('userId').head(N_FAVOURITES)
+                            .groupby('userId')['movieId'].agg(list))
+    relevant = later.groupby('userId')['movieId'].agg(list)
+    users = np.intersect1d(favourites.index, relevant.index)
+    skipped = len(np.intersect1d(history['userId'].unique(), relevant.index)) - len(users)
+    if max_users is not None and len(users) > max_users:
+        users = np.sort(np.random.RandomState(seed).choice(users, max_users,
+                                                           replace=False))
+    return {'history': history.reset_index(drop=True),
+            'users': users,
+            'favourites': favourites.loc[users].tolist(),
+            'relevant': relevant.loc[users].tolist(),
+            'cutoff': int(cutoff),
+            'skipped': skipped}
+
+
+def ranking_metrics(recommended, relevant, k):
+    """Score a batch of top-k lists against the movies users liked.
+
+    Parameters
+    ----------
+    recommended : numpy.ndarray (int)
+        Movie IDs of shape (n_users, k), padded with -1.
+    relevant : list (list (int))
+        Liked Movie IDs of each user.
+    k : int
+        Length of the lists.
+
+    Returns
+    -------
+    dict
+        Per-user `precision`, `recall` and `ndcg` arrays.
+
+    """
+    hits = np.array([np.isin(row, liked) for row, liked in zip(recommended, relevant)],
+                    dtype=bool).reshape(len(recommended), k)
+    n_relevant = np.array([len(set(liked)) for liked in relevant])
+    discounts = 1 / np.log2(np.arange(2, k + 2))
+    ideal = np.cumsum(discounts)[np.minimum(n_relevant, k) - 1]
+    return {'precision': hits.sum(axis=1) / k,
+            'recall': hits.sum(axis=1) / n_relevant,
+            'ndcg': (hits * discounts).sum(axis=1) / ideal}
+
+
+def _train_svd(history):
+    # `train_colbased.py` is a standalone script, so it is loaded by path
+    spec = importlib.util.spec_from_file_location('train_colbased', TRAIN_SCRIPT)
+    train_colbased = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(train_colbased)
+    rating_matrix = build_rating_matrix(history['userId'], history['movieId'],
+                                        history['rating'])
+    model = train_colbased.svd_from_matrix(rating_matrix, SVD_PARAMS)
+    return rating_matrix, model
+
+
+def _recommend_svd(users, k):
+    rating_matrix, model = _split['svd']
+    rows = user_rows(rating_matrix, users)
+    # Users with history always have a row, as they have favourites
+    scores = model.pu[rows] @ model.qi.T + model.bi
+    # Movies a user has already rated are not recommended
+    seen = rating_matrix.matrix[rows]
+    scores[np.repeat(np.arange(len(rows)), np.diff(seen.indptr)), seen.indices] = -np.inf
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+    return rating_matrix.item_ids[np.take_along_axis(top, order, axis=1)]
+
+
+def _recommend_model(func, favourites, k):
+    title_index = load_title_index()
+    recommended = np.full((len(favourites), k), -1, dtype=np.int64)
+    for n, movie_ids in enumerate(favourites):
+        titles = title_index.titles_of_ids(movie_ids)
+        # A title shared by several movies stands for the first of them
+        ids = [title_index.ids([title])[0] for title in func(titles, k)[:k]]
+        recommended[n, :len(ids)] = ids
+    return recommended
+
+
+def evaluate_batch(task):
+    """Recommend for, and score, one batch of evaluated users."""
+    algorithm, start, stop, k = task
+    users = _split['users'][start:stop]
+    favourites = _split['favourites'][start:stop]
+    begin = time.perf_counter()
+    if algorithm == 'svd':
+        recommended = _recommend_svd(users, k)
+    elif algorithm == 'content':
+        from recommenders.content_based import content_model
+        recommended = _recommend_model(content_model.__wrapped__, favourites, k)
+    else:
+        from recommenders.collaborative_based import collab_model
+        recommended = _recommend_model(collab_model.__wrapped__, favourites, k)
+    seconds = time.perf_counter() - begin
+    metrics = ranking_metrics(recommended, _split['relevant'][start:stop], k)
+    return metrics, np.unique(recommended[recommended >= 0]), seconds
+
+
+def evaluate(split, algorithms=ALGORITHMS, k=10, batch_size=256, n_jobs=None):
+    """Evaluate recommenders on a temporal split.
+
+    Parameters
+    ----------
+    split : dict
+        Split returned by `temporal_split`.
+    algorithms : list (str)
+        Any of 'content', 'collab' and 'svd'.
+    k : int
+        Number of recommendations per user.
+    batch_size : int
+        Users scored per worker task.
+    n_jobs : int, optional
+        Worker processes; defaults to every available core.
+
+    Returns
+    -------
+    dict
+        Per algorithm: mean `precision@k`, `recall@k` and `ndcg@k`,
+        `coverage`, the number of `users`, the wall time in `seconds`
+        and the throughput in `users_per_s`.
+
+    """
+    global _split
+    _split = split
+    if 'svd' in algorithms and 'svd' not in split:
+        split['svd'] = _train_svd(split['history'])
+    n_catalogue = len(load_title_index())
+    n_users = len(split['users'])
+    context = (multiprocessing.get_context('fork')
+               if 'fork' in multiprocessing.get_all_start_methods() else None)
+    results = {}
+    with ProcessPoolExecutor(n_jobs, mp_context=context) as pool:
+        for algorithm in algorithms:
+            tasks = [(algorithm, start, min(start + batch_size, n_users), k)
+                     for start in range(0, n_users, batch_size)]
+            start = time.perf_counter()
+            batches = list(pool.map(evaluate_batch, tasks))
+            seconds = time.perf_counter() - start
+            recommended = np.unique(np.concatenate([ids for _, ids, _ in batches]))
+            results[algorithm] = {
+                **{f'{name}@{k}': float(np.concatenate([m[name] for m, _, _ in batches]).mean())
+                   for name in ['precision', 'recall', 'ndcg']},
+                'coverage': len(recommended) / n_catalogue,
+                'users': n_users,
+                'seconds': seconds,
+                'users_per_s': n_users / seconds}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('Usage')[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--algorithms', nargs='*', default=ALGORITHMS,
+                        choices=ALGORITHMS)
+    parser.add_argument('-k', type=int, default=10,
+                        help='Recommendations per user.')
+    parser.add_argument('--test-fraction', type=float, default=0.2,
+                        help='Share of the latest ratings held out.')
+    parser.add_argument('--max-users', type=int, default=1000,
+                        help='Evaluate a sample of at most this many users.')
+    parser.add_argument('--batch-size', type=int, default=256,
+                        help='Users per worker task.')
+    parser.add_argument('--jobs', type=int,
+                        help='Worker processes (default: all cores).')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmarks/evaluation.json')
+    args = parser.parse_args()
+
+    split = temporal_split(load_rating_arrays(), args.test_fraction,
+                           args.max_users, args.seed,
+                           catalogue_ids=load_title_index().movie_ids)
+    print(f"Evaluating {len(split['users'])} users on ratings after "
+          f"{time.strftime('%Y-%m-%d', time.gmtime(split['cutoff']))} "
+          f"({split['skipped']} skipped: no favourite in the catalogue).")
+    results = evaluate(split, args.algorithms, args.k, args.batch_size, args.jobs)
+    for algorithm, metrics in results.items():
+        print(f"{algorithm:>8}: " + ', '.join(
+            f'{name} {value:.4f}' for name, value in metrics.items()
+            if name not in ('users', 'seconds', 'users_per_s'))
+            + f", {metrics['users_per_s']:.0f} users/s")
+    with open(args.output, 'w') as f:
+        json.dump({'k': args.k, 'test_fraction': args.test_fraction,
+                   'cutoff': split['cutoff'], 'skipped': split['skipped'],
+                   'results': results}, f, indent=2)
+    print(f'Results saved to: {args.output}')
+
+
+if __name__ == '__main__':
+    main()
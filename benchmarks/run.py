@@ -0,0 +1,235 @@
+"""
+
+    Benchmarks of the recommender hot paths.
+
+    Author: Explore Data Science Academy.
+
+    Description: Times each entry point of the app (`content_model`,
+    `collab_model`, `prediction_item` and `load_movie_titles`) in a fresh
+    Python process, so that import/startup cost and peak resident memory
+    are measured per entry point. Runs either against `resources/data`
+    or against synthetic MovieLens-shaped workspaces of a given number of
+    ratings. Results are written as JSON and can be compared against a
+    stored baseline.
+
+    Result caches are bypassed, and favourite movies are sampled with a
+    fixed seed, so that runs are reproducible. They are sampled by the
+    parent process and passed to the benchmarked process on its standard
+    input, so the catalogue is first loaded inside the timed calls.
+
+    Usage (from the root of the repository):
+
+        python -m benchmarks.run
+        python -m benchmarks.run --scales 10000 100000 1000000
+        python -m benchmarks.run --baseline benchmarks/baseline.json
+
+"""
+# Script dependencies
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENTRY_POINTS = ['content_model', 'collab_model', 'prediction_item',
+                'load_movie_titles']
+# Metrics compared against the baseline; higher is worse for all of them
+METRICS = ['import_s', 'first_call_s', 'p50_ms', 'p95_ms', 'peak_rss_mb']
+
+
+def _entry_point(name):
+    """Import an entry point, bypassing any result cache in front of it."""
+    if name == 'content_model':
+        from recommenders.content_based import content_model as func
+    elif name == 'collab_model':
+        from recommenders.collaborative_based import collab_model as func
+    elif name == 'prediction_item':
+        from recommenders.collaborative_based import prediction_item as func
+    else:
+        from utils.data_loader import load_movie_titles as func
+    return getattr(func, '__wrapped__', func)
+
+
+def _peak_rss_mb():
+    """Peak resident memory of this process, in megabytes."""
+    # VmHWM is reset by exec, unlike ru_maxrss which would include the
+    # memory of the parent process that spawned this one
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 2**10
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == 'darwin' else rss / 2**10
+
+
+def sample_favourites(workspace, n_calls, seed):
+    """Sample three favourite titles per call from a workspace's movies.
+
+    Parameters
+    ----------
+    workspace : str
+        Directory holding `resources/data/movies.csv`.
+    n_calls : int
+        Number of favourite lists to sample.
+    seed : int
+        Random seed.
+
+    Returns
+    -------
+    list (list (str))
+        Favourite titles of each call.
+
+    """
+    from utils.data_loader import MOVIES_PATH, load_title_index
+    titles = load_title_index(os.path.join(workspace, MOVIES_PATH)).listed_titles()
+    rng = np.random.RandomState(seed)
+    return [[titles[i] for i in rng.choice(len(titles), 3, replace=False)]
+            for _ in range(n_calls)]
+
+
+def run_worker(name, favourites):
+    """Benchmark one entry point in this process and print the result.
+
+    The first list of `favourites` is used for the first call, and each
+    of the others for one timed call.
+
+    """
+    start = time.perf_counter()
+    func = _entry_point(name)
+    import_s = time.perf_counter() - start
+
+    from utils.data_loader import MOVIES_PATH, load_title_index
+
+    def call(movies):
+        if name == 'load_movie_titles':
+            return func(MOVIES_PATH)
+        if name == 'prediction_item':
+            return func(load_title_index().ids(movies[:1])[0])
+        return func(movies, 10)
+
+    start = time.perf_counter()
+    call(favourites[0])
+    first_call_s = time.perf_counter() - start
+    timings = []
+    for movies in favourites[1:]:
+        start = time.perf_counter()
+        call(movies)
+        timings.append(time.perf_counter() - start)
+    print(json.dumps({'import_s': import_s,
+                      'first_call_s': first_call_s,
+                      'p50_ms': 1000 * float(np.percentile(timings, 50)),
+                      'p95_ms': 1000 * float(np.percentile(timings, 95)),
+                      'peak_rss_mb': _peak_rss_mb(),
+                      'repeat': len(timings)}))
+
+
+def run_entry_point(name, workspace, repeat, seed):
+    """Benchmark one entry point in a fresh process rooted at `workspace`."""
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT)
+    command = [sys.executable, '-m', 'benchmarks.run', '--worker', name]
+    favourites = sample_favourites(workspace, repeat + 1, seed)
+    output = subprocess.run(command, cwd=workspace, env=env, check=True,
+                            input=json.dumps(favourites),
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def compare(results, baseline, tolerance):
+    """Print metric ratios against a baseline and list regressions.
+
+    Returns
+    -------
+    list (str)
+        Descriptions of metrics more than `tolerance` (a fraction) worse
+        than the baseline.
+
+    """
+    regressions = []
+    for dataset, entries in results['results'].items():
+        for name, metrics in entries.items():
+            reference = baseline['results'].get(dataset, {}).get(name)
+            if reference is None:
+                continue
+            for metric in METRICS:
+                ratio = metrics[metric] / max(reference[metric], 1e-9)
+                flag = ''
+                if ratio > 1 + tolerance:
+                    flag = '  <-- regression'
+                    regressions.append(f'{dataset}/{name}/{metric}')
+                print(f'{dataset:>10} {name:>18} {metric:>13}: '
+                      f'{reference[metric]:10.3f} -> {metrics[metric]:10.3f} '
+                      f'({ratio:5.2f}x){flag}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('Usage')[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', type=int, nargs='*', default=[],
+                        help='Synthetic data sizes, in ratings. Without '
+                             'this, resources/data is benchmarked.')
+    parser.add_argument('--entry-points', nargs='*', default=ENTRY_POINTS,
+                        choices=ENTRY_POINTS)
+    parser.add_argument('--repeat', type=int, default=50,
+                        help='Timed calls per entry point.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmarks/results.json')
+    parser.add_argument('--baseline',
+                        help='Earlier results to compare against.')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed slowdown before a metric counts as '
+                             'a regression (0.2 = 20%%).')
+    parser.add_argument('--worker', choices=ENTRY_POINTS,
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        # The favourites are read before anything is timed
+        run_worker(args.worker, json.load(sys.stdin))
+        return
+
+    results = {'python': platform.python_version(),
+               'machine': platform.machine(),
+               'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'results': {}}
+    with tempfile.TemporaryDirectory() as scratch:
+        datasets = [('resources', REPO_ROOT)] if not args.scales else []
+        for scale in args.scales:
+            from benchmarks.synthetic import make_workspace
+            workspace = os.path.join(scratch, str(scale))
+            print(f'Generating synthetic data with {scale} ratings...')
+            make_workspace(workspace, scale, seed=args.seed)
+            datasets.append((f'synthetic-{scale}', workspace))
+        for dataset, workspace in datasets:
+            results['results'][dataset] = {}
+            for name in args.entry_points:
+                metrics = run_entry_point(name, workspace, args.repeat,
+                                          args.seed)
+                results['results'][dataset][name] = metrics
+                print(f'{dataset:>10} {name:>18}: import {metrics["import_s"]:.2f}s, '
+                      f'p50 {metrics["p50_ms"]:.2f}ms, p95 {metrics["p95_ms"]:.2f}ms, '
+                      f'peak RSS {metrics["peak_rss_mb"]:.0f}MB')
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'Results saved to: {args.output}')
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            sys.exit('Regressions: ' + ', '.join(regressions))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+
+    Synthetic MovieLens-shaped data for benchmarking.
+
+    Author: Explore Data Science Academy.
+
+    Description: Generates a workspace laid out like the root of this
+    repository (`resources/data`, `resources/models`) holding random
+    movies and ratings at a requested scale, together with the model
+    artefacts the recommenders load: the content neighbour index, a small
+    SVD model with its factor export, and its item-factor ANN index.
+
+"""
+# Script dependencies
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+import surprise
+
+from recommenders.content_index import build_content_index, save_content_index
+from utils.ann import build_ivf_index, save_ivf_index
+from utils.data_loader import file_digest
+from utils.genre_index import GENRES
+from utils.model_export import export_factors, factors_path
+
+
+def make_movies(n_movies, rng):
+    """Random movie records with MovieLens columns."""
+    years = rng.randint(1920, 2020, n_movies)
+    n_genres = rng.randint(1, 4, n_movies)
+    genres = [' '.join(rng.choice(GENRES, k, replace=False)) for k in n_genres]
+    return pd.DataFrame({
+        'movieId': np.arange(1, n_movies + 1, dtype=np.int32),
+        'title': [f'Movie {i} ({y})' for i, y in enumerate(years, 1)],
+        'genres': genres,
+        'year': years.astype(np.float32)})
+
+
+def make_ratings(n_ratings, n_users, n_movies, rng):
+    """Random ratings with a long-tailed (Zipf-like) movie popularity."""
+    popularity = 1.0 / np.arange(1, n_movies + 1)
+    popularity /= popularity.sum()
+    ratings = pd.DataFrame({
+        'userId': rng.randint(1, n_users + 1, n_ratings).astype(np.int32),
+        'movieId': (rng.choice(n_movies, n_ratings, p=popularity) + 1).astype(np.int32),
+        'rating': (rng.randint(1, 11, n_ratings) / 2).astype(np.float32),
+        'timestamp': rng.randint(789652009, 1574327703, n_ratings)})
+    return ratings.drop_duplicates(['userId', 'movieId'])
+
+
+def make_workspace(directory, n_ratings, seed=0, n_factors=50, n_epochs=5):
+    """Write a synthetic data set and its model artefacts.
+
+    Parameters
+    ----------
+    directory : str
+        Workspace root; the recommenders are run with this as the
+        working directory.
+    n_ratings : int
+        Number of ratings to generate (before removing duplicates).
+    seed : int
+        Random seed.
+    n_factors, n_epochs : int
+        SVD hyperparameters; kept small so generation stays quick.
+
+    """
+    rng = np.random.RandomState(seed)
+    n_users = max(50, n_ratings // 50)
+    n_movies = min(62000, max(1000, n_ratings // 20))
+    data_dir = os.path.join(directory, 'resources', 'data')
+    model_dir = os.path.join(directory, 'resources', 'models')
+    os.makedirs(data_dir, exist_ok=True)
+    os.makedirs(model_dir, exist_ok=True)
+
+    movies = make_movies(n_movies, rng)
+    ratings = make_ratings(n_ratings, n_users, n_movies, rng)
+    movies.to_csv(os.path.join(data_dir, 'movies.csv'), index=False)
+    ratings.to_csv(os.path.join(data_dir, 'ratings.csv'), index=False)
+
+    movies_path = os.path.join(data_dir, 'movies.csv')
+    save_content_index(build_content_index(movies),
+                       os.path.join(model_dir, 'content_neighbours.npz'),
+                       source_digest=file_digest(movies_path))
+    reader = surprise.Reader(rating_scale=(0.5, 5))
+    data_load = surprise.Dataset.load_from_df(
+        ratings[['userId', 'movieId', 'rating']], reader)
+    model = surprise.SVD(n_factors=n_factors, n_epochs=n_epochs,
+                         random_state=seed).fit(data_load.build_full_trainset())
+    model_path = os.path.join(model_dir, 'team2_SVD_recommender.pkl')
+    with open(model_path, 'wb') as f:
+        pickle.dump(model, f)
+    export_factors(model, factors_path(model_path),
+                   source_digest=file_digest(model_path))
+    item_ids = np.array([model.trainset.to_raw_iid(i)
+                         for i in model.trainset.all_items()])
+    save_ivf_index(build_ivf_index(model.qi, item_ids),
+                   os.path.join(model_dir, 'team2_SVD_recommender.ann.npz'))
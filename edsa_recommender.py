@@ -25,19 +25,129 @@
 	https://docs.streamlit.io/en/latest/
 
 """
+import contextlib
+import logging
+import os
+from collections import deque
+
 import numpy as np
 # Data handling dependencies
 import pandas as pd
 # Streamlit dependencies
 import streamlit as st
 
-from recommenders.collaborative_based import collab_model
-from recommenders.content_based import content_model
-import recommenders.collaborative_based as collab
-from utils.data_loader import load_movie_titles
+from utils import background
+from utils.data_loader import (load_genre_index, load_movie_titles, load_movies,
+                               load_popularity, load_title_index)
+from utils.genre_index import GENRES, filter_movies
+from utils.popularity import genres_of, popular_movies
+from utils import instrumentation
+from utils.result_cache import recommendation_cache
 # Data Loading
 title_list = load_movie_titles('resources/data/movies.csv')
 
+# Seconds to wait for a recommendation before showing a fallback answer
+RECOMMENDATION_TIMEOUT = float(os.environ.get('RECOMMENDATION_TIMEOUT', 10))
+
+logger = logging.getLogger(__name__)
+
+# The recommenders are imported on first use, so pages which do not
+# recommend anything never load the models or scikit-learn/scipy.
+def _content_model(movie_list, top_n=10):
+    from recommenders.content_based import content_model
+    return content_model(movie_list, top_n)
+
+def _collab_model(movie_list, top_n=10):
+    from recommenders.collaborative_based import collab_model
+    return collab_model(movie_list, top_n)
+
+def content_model(movie_list, top_n=10):
+    """Content-based recommendations, computed in the background."""
+    return recommend(_content_model, movie_list, top_n)
+
+def collab_model(movie_list, top_n=10):
+    """Collaborative recommendations, computed in the background."""
+    return recommend(_collab_model, movie_list, top_n)
+
+def fallback_recommendations(model, movie_list, top_n=10):
+    """Fast answer shown when a request misses its latency budget.
+
+    Parameters
+    ----------
+    model : function
+        `_content_model` or `_collab_model`.
+    movie_list : list (str)
+        Favorite movies chosen by the app user.
+    top_n : int
+        Number of recommendations.
+
+    Returns
+    -------
+    list (str)
+        The cached result of the request, if another session computed it
+        in the meantime, else the most popular movies of the genres of the
+        chosen movies.
+
+    """
+    if model is _content_model:
+        from recommenders.content_based import content_model as cached
+    else:
+        from recommenders.collaborative_based import collab_model as cached
+    found, value = cached.lookup(movie_list, top_n)
+    if found:
+        return value
+    title_index = load_title_index()
+    rows = title_index.rows(movie_list)
+    top_ids = popular_movies(load_popularity(), top_n,
+                             genres=genres_of(load_movies(), rows),
+                             exclude=title_index.movie_ids[rows])
+    return title_index.titles_of_ids(top_ids)
+
+def recommend(model, movie_list, top_n=10):
+    """Run a recommender in the background, within a latency budget.
+
+    The request is shared with later reruns of the session asking for
+    the same movies, and cancelled if the selection changes first. If
+    it takes longer than `RECOMMENDATION_TIMEOUT`, a fallback answer is
+    returned (and the request keeps running, so pressing Recommend again
+    shows its result once ready).
+
+    Parameters
+    ----------
+    model : function
+        `_content_model` or `_collab_model`.
+    movie_list : list (str)
+        Favorite movies chosen by the app user.
+    top_n : int
+        Number of recommendations.
+
+    Returns
+    -------
+    list (str)
+        Titles of the recommended movies.
+
+    """
+    key = (model.__name__, frozenset(movie_list), top_n)
+    # With the debug panel on, the session's requests are timed, and the
+    # last trace is kept in the session for the panel to show
+    timing = (instrumentation.collect(
+                  st.session_state.setdefault('timing_traces', deque(maxlen=1)).append)
+              if st.session_state.get('show_timings') else contextlib.nullcontext())
+    with timing:
+        future = background.submit(st.session_state, key, model, movie_list, top_n)
+    try:
+        done, recommendations = background.wait(st.session_state, future,
+                                                RECOMMENDATION_TIMEOUT)
+    except Exception:
+        logger.exception('%s failed for %s', model.__name__, movie_list)
+        raise
+    if done:
+        return recommendations
+    recommendations = fallback_recommendations(model, movie_list, top_n)
+    st.info('This is taking longer than usual, so here is a quicker '
+            'answer. Press Recommend again for the full one.')
+    return recommendations
+
 # App declaration
 def main():
 
@@ -161,31 +271,22 @@ def main():
 
         # Container for year/genre filtered DF
         with st.beta_container():
-            # Load movies.csv dataframe:
-            movies_df = pd.read_csv('resources/data/movies.csv', index_col='movieId')
+            # Load movies.csv dataframe and its genre/year index:
+            movies_df = load_movies()
+            genre_index = load_genre_index()
 
             # Year selection
             st.subheader('Enter your preferred release-year range')
             start_year = st.slider("Start Year", 1874, 2019)
             end_year = st.slider('End Year', start_year, 2019)
-            movies_df = movies_df[(movies_df['year']>=start_year) & (movies_df['year']<=end_year)]
 
             # Genre selection
             st.subheader('Enter your preferred genres')
-            genres_list = ['Documentary', 'Animation','Film-Noir','Romance','Adventure',
-            'Western','Children','Sci-Fi','Drama','Thriller',
-            'Mystery','War','Comedy','Action','IMAX','Musical','Fantasy','Horror','Crime']
-            genres = list(st.multiselect('Select genres', genres_list))
-            drop_rows = []
-            for index, row in movies_df.iterrows():
-                if set(genres).issubset(set(row['genres'].split())):
-                    pass
-                else:
-                    drop_rows.append(index)
-            
-            movies_df = movies_df.drop(drop_rows)
-
+            genres = list(st.multiselect('Select genres', GENRES))
 
+            # Binary search on year plus a bitwise AND on genres
+            rows = filter_movies(genre_index, start_year, end_year, genres)
+            movies_df = movies_df.iloc[rows].set_index('movieId')
 
             # Display filtered DF
             st.dataframe(movies_df)
@@ -233,6 +334,31 @@ def main():
             result = message.title()
             st.success("Thank you, we'll be in touch!")
 
+    # A request for movies that are no longer selected is not needed
+    if page_selection == "Recommender System":
+        model = _content_model if sys == 'Content Based Filtering' else _collab_model
+        background.cancel_stale(st.session_state,
+                                (model.__name__, frozenset(fav_movies), 10))
+    else:
+        background.cancel_stale(st.session_state, None)
+
+    # Optional debug panel with the per-stage timings of the session's last
+    # request (see `recommend`)
+    if st.sidebar.checkbox('Show timing breakdown', key='show_timings'):
+        traces = st.session_state.get('timing_traces')
+        last = traces[-1] if traces else None
+        st.sidebar.subheader('Last request')
+        if last is None:
+            st.sidebar.info('Press Recommend to time a request.')
+        else:
+            st.sidebar.write(f'**{last.name}**: {last.total_ms:.1f} ms')
+            spans = pd.DataFrame(last.as_dict()['spans'], columns=['name', 'depth', 'ms'])
+            spans['name'] = ['. ' * depth + name for name, depth in zip(spans['name'], spans['depth'])]
+            st.sidebar.table(spans[['name', 'ms']])
+        st.sidebar.subheader('Counters')
+        st.sidebar.json({**instrumentation.counters(),
+                         'result_cache': recommendation_cache.stats()})
+
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
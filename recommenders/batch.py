@@ -0,0 +1,259 @@
+"""
+
+    Batch recommendation from the command line.
+
+    Author: Explore Data Science Academy.
+
+    Description: Computes recommendations for many lists of favourite
+    movies at once, e.g. to precompute tables for frequent users or to
+    pre-warm the app's result cache. Requests are read from a JSON lines
+    file, one per line, either as a list of titles or as an object with an
+    `id` and a `movies` list. Requests are split into chunks which are
+    processed across a pool of worker processes, and results are streamed
+    to a JSON lines file in input order, so only a bounded number of
+    chunks is ever held in memory.
+
+    Within a chunk, collaborative filtering searches the item-factor ANN
+    index once for every distinct favourite movie of the chunk, rather
+    than once per request.
+
+    Usage (from the root of the repository):
+
+        python -m recommenders.batch requests.jsonl recommendations.jsonl
+        python -m recommenders.batch requests.jsonl out.jsonl --algorithm content
+        python -m recommenders.batch requests.jsonl out.jsonl --verify 100
+
+"""
+# Script dependencies
+import argparse
+import collections
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+ALGORITHMS = ['collab', 'content']
+
+
+def read_requests(path):
+    """Lazily parse a JSON lines file of favourite-movie lists.
+
+    Yields
+    ------
+    tuple (object, list (str))
+        The id of the request (its line number if none is given) and its
+        favourite movies.
+
+    """
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            if isinstance(request, dict):
+                yield request.get('id', number), request['movies']
+            else:
+                yield number, request
+
+
+def _content_chunk(movie_lists, top_n):
+    from recommenders.content_based import content_model
+    # The neighbour index is already a table of precomputed results, so
+    # each request is only a gather and a merge
+    return [content_model.__wrapped__(movies, top_n) for movies in movie_lists]
+
+
+def _collab_chunk(movie_lists, top_n):
+    from recommenders.collaborative_based import (collab_model, fill_popular,
+                                                  item_index, merge_neighbours)
+    from utils.ann import search
+    from utils.data_loader import load_title_index
+
+    index = item_index()
+    if index is None:
+        return [collab_model.__wrapped__(movies, top_n) for movies in movie_lists]
+    title_index = load_title_index()
+    chosen = [title_index.ids(movies) for movies in movie_lists]
+    # Search once for each distinct favourite movie of the chunk
+    queried = np.isin(index['ids'], np.concatenate(chosen))
+    k = 5 * top_n + max(len(ids) for ids in chosen)
+    neighbours = dict(zip(index['ids'][queried],
+                          search(index, index['vectors'][queried], k=k)))
+    results = []
+    for movies, chosen_ids in zip(movie_lists, chosen):
+        # Trimmed to the results `nearest_items` would have fetched
+        k = 5 * top_n + len(chosen_ids)
+        found = [(ids[:k], scores[:k]) for ids, scores in
+                 (neighbours[i] for i in chosen_ids if i in neighbours)]
+        top_ids = merge_neighbours(found, chosen_ids, top_n)
+        top_ids = fill_popular(movies, chosen_ids, top_ids, top_n)
+        results.append(title_index.titles_of_ids(top_ids))
+    return results
+
+
+def recommend_chunk(algorithm, movie_lists, top_n=10):
+    """Recommend movies for each of several lists of favourites.
+
+    Parameters
+    ----------
+    algorithm : str
+        'collab' or 'content'.
+    movie_lists : list (list (str))
+        Favourite movies of each request.
+    top_n : int
+        Number of recommendations per request.
+
+    Returns
+    -------
+    list (list (str))
+        Recommended titles for each request, as returned by
+        `collab_model` or `content_model`.
+
+    """
+    if algorithm == 'collab':
+        return _collab_chunk(movie_lists, top_n)
+    return _content_chunk(movie_lists, top_n)
+
+
+def _chunks(requests, chunk_size):
+    while True:
+        chunk = list(itertools.islice(requests, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def run(input_path, output_path, algorithm='collab', top_n=10,
+        chunk_size=256, jobs=None, warm_cache=False):
+    """Recommend movies for every request of a file.
+
+    Parameters
+    ----------
+    input_path : str
+        JSON lines file of requests.
+    output_path : str
+        JSON lines file the results are written to, one object per
+        request with its `id`, `movies` and `recommendations`.
+    algorithm : str
+        'collab' or 'content'.
+    top_n : int
+        Number of recommendations per request.
+    chunk_size : int
+        Number of requests sent to a worker at once.
+    jobs : int, optional
+        Number of worker processes; all CPUs are used if None.
+    warm_cache : bool
+        Also store every result in the app's result cache (which persists
+        only if `RECOMMENDATION_CACHE_PATH` is set).
+
+    Returns
+    -------
+    int
+        Number of requests processed.
+
+    """
+    jobs = jobs or os.cpu_count()
+    if warm_cache:
+        if algorithm == 'collab':
+            from recommenders.collaborative_based import collab_model as model
+        else:
+            from recommenders.content_based import content_model as model
+    pending = collections.deque()
+    count = 0
+
+    def write_oldest(f):
+        chunk, future = pending.popleft()
+        for (request_id, movies), recommended in zip(chunk, future.result()):
+            f.write(json.dumps({'id': request_id, 'movies': movies,
+                                'recommendations': recommended}) + '\n')
+            if warm_cache:
+                model.prime(movies, top_n, recommended)
+        return len(chunk)
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool, \
+            open(output_path, 'w') as f:
+        for chunk in _chunks(read_requests(input_path), chunk_size):
+            pending.append((chunk, pool.submit(recommend_chunk, algorithm,
+                                               [m for _, m in chunk], top_n)))
+            # Bound the number of chunks held in memory
+            if len(pending) >= 2 * jobs:
+                count += write_oldest(f)
+        while pending:
+            count += write_oldest(f)
+    return count
+
+
+def verify(output_path, algorithm='collab', top_n=10, n_requests=None):
+    """Check batch results against the interactive recommender.
+
+    Parameters
+    ----------
+    output_path : str
+        JSON lines file written by `run`.
+    algorithm : str
+        'collab' or 'content'.
+    top_n : int
+        Number of recommendations per request.
+    n_requests : int, optional
+        Check only the first this many requests.
+
+    Returns
+    -------
+    list
+        Ids of the requests whose batch result differs from what
+        `collab_model`/`content_model` return.
+
+    """
+    if algorithm == 'collab':
+        from recommenders.collaborative_based import collab_model as model
+    else:
+        from recommenders.content_based import content_model as model
+    mismatches = []
+    with open(output_path) as f:
+        for line in itertools.islice(f, n_requests):
+            result = json.loads(line)
+            expected = model.__wrapped__(result['movies'], top_n)
+            if result['recommendations'] != expected:
+                mismatches.append(result['id'])
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('Usage')[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', help='JSON lines file of favourite movies.')
+    parser.add_argument('output', help='JSON lines file of recommendations.')
+    parser.add_argument('--algorithm', choices=ALGORITHMS, default='collab')
+    parser.add_argument('--top-n', type=int, default=10)
+    parser.add_argument('--chunk-size', type=int, default=256,
+                        help='Requests per worker task.')
+    parser.add_argument('--jobs', type=int,
+                        help='Worker processes (default: all CPUs).')
+    parser.add_argument('--warm-cache', action='store_true',
+                        help='Also store the results in the result cache.')
+    parser.add_argument('--verify', type=int, metavar='N',
+                        help='Check the first N results against the '
+                             'interactive recommender.')
+    args = parser.parse_args()
+
+    start = time.time()
+    count = run(args.input, args.output, args.algorithm, args.top_n,
+                args.chunk_size, args.jobs, args.warm_cache)
+    elapsed = time.time() - start
+    print(f'{count} requests in {elapsed:.1f}s '
+          f'({count / max(elapsed, 1e-9):.0f} requests/s)')
+    print(f'Results saved to: {args.output}')
+    if args.verify:
+        mismatches = verify(args.output, args.algorithm, args.top_n, args.verify)
+        if mismatches:
+            raise SystemExit(f'{len(mismatches)} results differ from the '
+                             f'interactive recommender: {mismatches[:10]}')
+        print(f'Checked {min(args.verify, count)} results against the '
+              f'interactive recommender.')
+
+
+if __name__ == '__main__':
+    main()
@@ -28,26 +28,132 @@
 """
 
 # Script dependencies
+import os
 import pandas as pd
 import numpy as np
-import pickle
-import copy
-from surprise import Reader, Dataset
-from surprise import SVD, NormalPredictor, BaselineOnly, KNNBasic, NMF
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import CountVectorizer
-
-# Importing data
-movies_df = pd.read_csv('resources/data/movies.csv',sep = ',',delimiter=',')
-ratings_df = pd.read_csv('resources/data/ratings.csv')
-ratings_df.drop(['timestamp'], axis=1,inplace=True)
-
-movies_df = movies_df[movies_df['movieId'].isin(ratings_df['movieId'])]
+
+from utils.ann import search, vectors_of
+from utils.data_loader import (MOVIES_PATH, RATINGS_PATH, artefact_version,
+                               load_arrays, load_factors, load_model,
+                               load_movies, load_popularity, load_rating_matrix,
+                               load_title_index, resource_cache)
+from utils.model_export import MANIFEST, factors_path
+from utils.popularity import POPULARITY_PATH, fill_with_popular, genres_of
+from utils.rating_matrix import item_columns, item_similarity, user_rows
+from utils.instrumentation import span, timed
+from utils.result_cache import cached_recommendations
+
+# Nothing is loaded when this module is imported: the data and the model
+# are loaded (once per process) on first use, through the accessors below.
+
 # We make use of an SVD model trained on a subset of the MovieLens 10k dataset.
-model=pickle.load(open('resources/models/team2_SVD_recommender.pkl', 'rb'))
+MODEL_PATH = 'resources/models/team2_SVD_recommender.pkl'
 
 # model=pickle.load(open('resources/models/SVD.pkl', 'rb'))
 
+# Memory-mapped float32 export of the model (see `utils/model_export.py`),
+# used instead of the pickle when it is up to date
+FACTORS_PATH = factors_path(MODEL_PATH)
+
+# Approximate nearest-neighbour index over the model's item factors, built
+# by `resources/models/train_colbased.py` alongside the model.
+ITEM_INDEX_PATH = 'resources/models/team2_SVD_recommender.ann.npz'
+
+# Movies scored by the neighbourhood search: only the most popular ones
+# are candidates, as rarely rated movies make poor recommendations anyway
+POPULAR_CANDIDATES = 10000
+
+@resource_cache
+def _svd_factors(path, digest):
+    factors = load_factors(path)
+    if factors is None:
+        # No up-to-date export: fall back on unpickling the whole model
+        model = load_model(path)
+        trainset = model.trainset
+        factors = {'user_factors': model.pu,
+                   'item_factors': model.qi,
+                   'global_mean': 0.0,
+                   'user_biases': np.zeros(trainset.n_users),
+                   'item_biases': np.zeros(trainset.n_items),
+                   'user_ids': np.array([trainset.to_raw_uid(u) for u in trainset.all_users()]),
+                   'item_ids': np.array([trainset.to_raw_iid(i) for i in trainset.all_items()]),
+                   'rating_scale': trainset.rating_scale}
+        if model.biased:
+            factors.update(global_mean=trainset.global_mean,
+                           user_biases=model.bu, item_biases=model.bi)
+    return {**factors, 'item_rows': pd.Index(factors['item_ids'])}
+
+def svd_factors():
+    """Latent factors and biases of the trained model, so that users can be
+    scored with array operations rather than one `model.predict` at a time.
+
+    Returns
+    -------
+    dict
+        The model's `user_factors`, `item_factors`, `global_mean`,
+        `user_biases`, `item_biases` and `rating_scale`, the raw
+        `user_ids` and `item_ids` of the factor rows, and `item_rows`,
+        an index from raw item ids to rows.
+
+    """
+    return _svd_factors(MODEL_PATH, artefact_version(
+        MODEL_PATH, os.path.join(FACTORS_PATH, MANIFEST)))
+
+def item_index():
+    """The ANN index over the model's item factors, or None if not built."""
+    if not os.path.exists(ITEM_INDEX_PATH):
+        return None
+    return load_arrays(ITEM_INDEX_PATH)
+
+@timed('predict_items')
+def predict_items(item_ids):
+    """Predict the rating every user within the model gives to each item.
+
+    Parameters
+    ----------
+    item_ids : list (int)
+        MovieLens Movie IDs.
+
+    Returns
+    -------
+    numpy.ndarray
+        Estimated ratings of shape (len(item_ids), number of users), with
+        columns ordered as `user_ids`. Items unknown to the model are
+        scored from the global mean and user biases only.
+
+    """
+    factors = svd_factors()
+    rows = factors['item_rows'].get_indexer(np.asarray(item_ids))
+    known = rows >= 0
+    rows[~known] = 0
+    estimates = factors['item_factors'][rows] @ factors['user_factors'].T
+    estimates += factors['item_biases'][rows][:, np.newaxis]
+    estimates[~known] = 0
+    estimates += factors['global_mean'] + factors['user_biases']
+    return np.clip(estimates, *factors['rating_scale'])
+
+def top_users(item_ids, top_n=10):
+    """Find the users with the highest predicted rating for each item.
+
+    Parameters
+    ----------
+    item_ids : list (int)
+        MovieLens Movie IDs.
+    top_n : int
+        Number of users to return per item.
+
+    Returns
+    -------
+    numpy.ndarray
+        User IDs of shape (len(item_ids), top_n), best first.
+
+    """
+    estimates = predict_items(item_ids)
+    top_n = min(top_n, estimates.shape[1])
+    top = np.argpartition(estimates, -top_n, axis=1)[:, -top_n:]
+    order = np.argsort(-np.take_along_axis(estimates, top, axis=1), axis=1)
+    return svd_factors()['user_ids'][np.take_along_axis(top, order, axis=1)]
+
 def prediction_item(item_id):
     """Map a given favourite movie to users within the
        MovieLens dataset with the same preference.
@@ -63,16 +169,9 @@ def prediction_item(item_id):
         User IDs of users with similar high ratings for the given movie.
 
     """
-    # Data preprosessing
-    reader = Reader(rating_scale=(0, 5))
-    load_df = Dataset.load_from_df(ratings_df,reader)
-    a_train = load_df.build_full_trainset()
-
-    predictions = []
-    for ui in a_train.all_users():
-        predictions.append(model.predict(iid=item_id,uid=ui, verbose = False))
-    return predictions
+    return list(top_users([item_id])[0])
 
+@timed('pred_movies')
 def pred_movies(movie_list):
     """Maps the given favourite movies selected within the app to corresponding
     users within the MovieLens dataset.
@@ -88,21 +187,143 @@ def pred_movies(movie_list):
         User-ID's of users with similar high ratings for each movie.
 
     """
-    # Store the id of users
-    id_store=[]
-    # For each movie selected by a user of the app,
-    # predict a corresponding user within the dataset with the highest rating
-    for i in movie_list:
-        predictions = prediction_item(item_id = i)
-        predictions.sort(key=lambda x: x.est, reverse=True)
-        # Take the top 10 user id's from each movie with highest rankings
-        for pred in predictions[:10]:
-            id_store.append(pred.uid)
+    # Look up the MovieLens id of each selected title
+    item_ids = load_title_index().ids(movie_list)
+    # For each movie selected by a user of the app, take the 10 users
+    # within the dataset with the highest predicted rating, in one batch
+    id_store = top_users(item_ids, top_n=10).ravel()
     # Return a list of user id's
-    return id_store
+    return list(id_store)
+
+@timed('ann_search')
+def nearest_items(chosen_ids, top_n=10):
+    """Find the movies whose SVD item factors are closest to the chosen ones.
+
+    Parameters
+    ----------
+    chosen_ids : list (int)
+        MovieLens Movie IDs of the favourite movies.
+    top_n : int
+        Number of movies to return.
+
+    Returns
+    -------
+    numpy.ndarray
+        Movie IDs, best first. Movies similar to several favourites rank
+        higher, as their similarities are summed.
+
+    """
+    index = item_index()
+    results = search(index, vectors_of(index, chosen_ids),
+                     k=5 * top_n + len(chosen_ids))
+    return merge_neighbours(results, chosen_ids, top_n)
+
+def merge_neighbours(results, chosen_ids, top_n=10):
+    """Rank the union of the ANN results of several favourite movies.
+
+    Parameters
+    ----------
+    results : list (tuple (numpy.ndarray, numpy.ndarray))
+        Ids and similarities of the nearest items of each favourite, as
+        returned by `utils.ann.search`.
+    chosen_ids : list (int)
+        MovieLens Movie IDs of the favourite movies.
+    top_n : int
+        Number of movies to return.
+
+    Returns
+    -------
+    numpy.ndarray
+        Movie IDs, best first.
+
+    """
+    if not results:
+        return np.array([], dtype=np.int32)
+    ids = np.concatenate([ids for ids, _ in results])
+    candidates, position = np.unique(ids, return_inverse=True)
+    scores = np.bincount(position,
+                         weights=np.concatenate([s for _, s in results]))
+    # Removing chosen movies and movies without a title
+    scores[np.isin(candidates, chosen_ids)] = -np.inf
+    scores[load_title_index().rows_of_ids(candidates) < 0] = -np.inf
+    top = np.argsort(-scores, kind='stable')[:top_n]
+    return candidates[top[np.isfinite(scores[top])]]
+
+@timed('neighbourhood_search')
+def neighbourhood_items(movie_list, chosen_ids, top_n=10):
+    """Find the movies most similar to the chosen ones amongst the ratings of
+    users predicted to like them.
+
+    Parameters
+    ----------
+    movie_list : list (str)
+        Favorite movies chosen by the app user.
+    chosen_ids : list (int)
+        MovieLens Movie IDs of the favourite movies.
+    top_n : int
+        Number of movies to return.
+
+    Returns
+    -------
+    numpy.ndarray
+        Movie IDs, best first.
+
+    """
+    # Users with the highest predicted ratings for the chosen movies
+    user_ids = np.unique(pred_movies(movie_list))
+    rating_matrix = load_rating_matrix()
+    # Only the chosen movies and the most popular ones are scored
+    candidates = np.concatenate(
+        [chosen_ids, load_popularity()['ranking'][:POPULAR_CANDIDATES]])
+    columns = np.unique(item_columns(rating_matrix, candidates))
+    item_ids = rating_matrix.item_ids[columns]
+    neighbourhood = rating_matrix.matrix[user_rows(rating_matrix, user_ids)][:, columns]
+    chosen = np.flatnonzero(np.isin(item_ids, chosen_ids))
+    # Cosine similarity of the chosen movies to every candidate, over the
+    # ratings given by the neighbourhood of users
+    with span('item_similarity'):
+        cosine_sim = item_similarity(neighbourhood, chosen)
+    # Calculating the scores
+    scores = cosine_sim.sum(axis=0)
+    # Removing chosen movies and movies without a title
+    scores[chosen] = -np.inf
+    scores[load_title_index().rows_of_ids(item_ids) < 0] = -np.inf
+    top_indexes = np.argsort(-scores, kind='stable')[:top_n]
+    # Movies no neighbour rated are left to the popularity fallback
+    return item_ids[top_indexes[scores[top_indexes] > 0]]
+
+def fill_popular(movie_list, chosen_ids, top_ids, top_n=10):
+    """Pad recommendations with popular movies of the chosen movies' genres.
+
+    Parameters
+    ----------
+    movie_list : list (str)
+        Favorite movies chosen by the app user.
+    chosen_ids : list (int)
+        MovieLens Movie IDs of the favourite movies.
+    top_ids : numpy.ndarray (int)
+        MovieLens Movie IDs recommended so far, best first.
+    top_n : int
+        Number of movies wanted.
+
+    Returns
+    -------
+    numpy.ndarray
+        Up to `top_n` MovieLens Movie IDs, best first.
+
+    """
+    # The movies and the popularity table are only read when needed
+    if len(top_ids) >= top_n:
+        return top_ids
+    genres = genres_of(load_movies(), load_title_index().rows(movie_list))
+    return fill_with_popular(load_popularity(), top_ids, top_n,
+                             exclude=chosen_ids, genres=genres)
 
 # !! DO NOT CHANGE THIS FUNCTION SIGNATURE !!
 # You are, however, encouraged to change its content.  
+@cached_recommendations('collab', [MOVIES_PATH, RATINGS_PATH, MODEL_PATH,
+                                   os.path.join(FACTORS_PATH, MANIFEST),
+                                   ITEM_INDEX_PATH, POPULARITY_PATH])
 def collab_model(movie_list,top_n=10):
     """Performs Collaborative filtering based upon a list of movies supplied
        by the app user.
@@ -121,31 +342,17 @@ def collab_model(movie_list,top_n=10):
 
     """
 
-    indices = pd.Series(movies_df['title'])
-    movie_ids = pred_movies(movie_list)
-    df_init_users = ratings_df[ratings_df['userId']==movie_ids[0]]
-    for i in movie_ids :
-        df_init_users=df_init_users.append(ratings_df[ratings_df['userId']==i])
-    # Getting the cosine similarity matrix
-    cosine_sim = cosine_similarity(np.array(df_init_users), np.array(df_init_users))
-    idx_1 = indices[indices == movie_list[0]].index[0]
-    idx_2 = indices[indices == movie_list[1]].index[0]
-    idx_3 = indices[indices == movie_list[2]].index[0]
-    # Creating a Series with the similarity scores in descending order
-    rank_1 = cosine_sim[idx_1]
-    rank_2 = cosine_sim[idx_2]
-    rank_3 = cosine_sim[idx_3]
-    # Calculating the scores
-    score_series_1 = pd.Series(rank_1).sort_values(ascending = False)
-    score_series_2 = pd.Series(rank_2).sort_values(ascending = False)
-    score_series_3 = pd.Series(rank_3).sort_values(ascending = False)
-     # Appending the names of movies
-    listings = score_series_1.append(score_series_1).append(score_series_3).sort_values(ascending = False)
-    recommended_movies = []
-    # Choose top 50
-    top_50_indexes = list(listings.iloc[1:50].index)
-    # Removing chosen movies
-    top_indexes = np.setdiff1d(top_50_indexes,[idx_1,idx_2,idx_3])
-    for i in top_indexes[:top_n]:
-        recommended_movies.append(list(movies_df['title'])[i])
+    title_index = load_title_index()
+    with span('resolve_titles'):
+        chosen_ids = title_index.ids(movie_list)
+    if item_index() is not None:
+        top_ids = nearest_items(chosen_ids, top_n)
+    else:
+        top_ids = neighbourhood_items(movie_list, chosen_ids, top_n)
+    # Movies unknown to the model get popular movies of the same genres
+    with span('popularity_fallback'):
+        top_ids = fill_popular(movie_list, chosen_ids, top_ids, top_n)
+    # Appending the names of movies
+    with span('materialise_titles'):
+        recommended_movies = title_index.titles_of_ids(top_ids)
     return recommended_movies
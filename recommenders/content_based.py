@@ -29,38 +29,68 @@
 
 # Script dependencies
 import os
+
 import pandas as pd
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
-
-# Importing data
-movies = pd.read_csv('resources/data/movies.csv', sep = ',',delimiter=',')
-ratings = pd.read_csv('resources/data/ratings.csv')
-movies.dropna(inplace=True)
-
-def data_preprocessing(subset_size):
-    """Prepare data for use within Content filtering algorithm.
 
-    Parameters
-    ----------
-    subset_size : int
-        Number of movies to use within the algorithm.
+from recommenders.content_index import INDEX_PATH
+from utils.data_loader import (MOVIES_PATH, file_digest, load_arrays,
+                               load_movies, load_popularity, load_title_index,
+                               resource_cache)
+from utils.instrumentation import span, trace
+from utils.popularity import POPULARITY_PATH, fill_with_popular, genres_of
+from utils.result_cache import cached_recommendations
+
+# Nothing is loaded when this module is imported: the movies and the
+# neighbour index are loaded (once per process) on first use.
+
+@resource_cache
+def _neighbour_index(path, digest):
+    arrays = load_arrays(path)
+    return arrays, pd.Index(arrays['movie_ids'])
+
+@resource_cache
+def _build_neighbour_index(path, digest):
+    # scikit-learn is only needed, and imported, when the index is built
+    from recommenders.content_index import (build_content_index, build_features,
+                                            load_features, save_content_index)
+    with trace('build_content_index'):
+        movies = load_movies(path)
+        # Saved TF-IDF features are reused for the movies that did not change
+        index = build_content_index(movies,
+                                    features=build_features(movies, load_features()))
+    # Saved under a temporary name first, so a concurrent reader never
+    # sees a partial archive
+    temporary = f'{INDEX_PATH}.{os.getpid()}.npz'
+    index['source_digest'] = np.array(digest)
+    save_content_index(index, temporary)
+    os.replace(temporary, INDEX_PATH)
+    return index, pd.Index(index['movie_ids'])
+
+def neighbour_index():
+    """Precomputed top-K neighbours (see `recommenders/content_index.py`).
+
+    The index saved by `python -m recommenders.content_index` is used if
+    it was built from the current `movies.csv`, otherwise it is rebuilt
+    from the movies and saved, which takes a while on first use.
 
     Returns
     -------
-    Pandas Dataframe
-        Subset of movies selected for content-based filtering.
+    tuple
+        The index arrays, and a `pandas.Index` mapping MovieLens ids to
+        their rows.
 
     """
-    # Split genre data into individual words.
-    movies['keyWords'] = movies['genres'].str.replace('|', ' ') + movies['title']
-    # Subset of the data
-    movies_subset = movies[:subset_size]
-    return movies_subset
+    digest = file_digest(MOVIES_PATH)
+    if os.path.exists(INDEX_PATH):
+        index = _neighbour_index(INDEX_PATH, file_digest(INDEX_PATH))
+        if str(index[0].get('source_digest')) == digest:
+            return index
+    return _build_neighbour_index(MOVIES_PATH, digest)
 
 # !! DO NOT CHANGE THIS FUNCTION SIGNATURE !!
 # You are, however, encouraged to change its content.  
+@cached_recommendations('content', [MOVIES_PATH, INDEX_PATH, POPULARITY_PATH])
 def content_model(movie_list,top_n=10):
     """Performs Content filtering based upon a list of movies supplied
        by the app user.
@@ -78,35 +108,36 @@ def content_model(movie_list,top_n=10):
         Titles of the top-n movie recommendations to the user.
 
     """
-    # Initializing the empty list of recommended movies
-    recommended_movies = []
-    data = data_preprocessing(27000)
-    # Instantiating and generating the count matrix
-    tfidf_vec = TfidfVectorizer(ngram_range=(1,3))
-    tfidf_matrix = tfidf_vec.fit_transform(data['keyWords'])
-    indices = pd.Series(data['title'])
-    cosine_sim = cosine_similarity(tfidf_matrix, tfidf_matrix)
-    # Getting the index of the movie that matches the title
-    idx_1 = indices[indices == movie_list[0]].index[0]
-    idx_2 = indices[indices == movie_list[1]].index[0]
-    idx_3 = indices[indices == movie_list[2]].index[0]
-    # Creating a Series with the similarity scores in descending order
-    rank_1 = cosine_sim[idx_1]
-    rank_2 = cosine_sim[idx_2]
-    rank_3 = cosine_sim[idx_3]
-    # Calculating the scores
-    score_series_1 = pd.Series(rank_1).sort_values(ascending = False)
-    score_series_2 = pd.Series(rank_2).sort_values(ascending = False)
-    score_series_3 = pd.Series(rank_3).sort_values(ascending = False)
-    # Getting the indexes of the 10 most similar movies
-    listings = score_series_1.append(score_series_1).append(score_series_2).append(score_series_3).sort_values(ascending = False)
-
-    # Store movie names
-    recommended_movies = []
+    content_index, index_rows = neighbour_index()
+    title_index = load_title_index()
+    movie_ids = content_index['movie_ids']
+    # Getting the index row of each movie that matches the title
+    with span('resolve_titles'):
+        chosen_rows = index_rows.get_indexer(title_index.ids(movie_list))
+        chosen_rows = chosen_rows[chosen_rows >= 0]
+    # Merging the neighbour lists of the chosen movies, summing the scores
+    # of movies which neighbour more than one favourite
+    with span('merge_neighbours'):
+        candidates, position = np.unique(content_index['neighbours'][chosen_rows],
+                                         return_inverse=True)
+        scores = np.bincount(position.ravel(),
+                             weights=content_index['scores'][chosen_rows].ravel())
+        # Without any chosen movie the (empty) counts come back as integers
+        scores = scores.astype(np.float64, copy=False)
+        # Removing chosen movies and movies without a title
+        scores[np.isin(candidates, chosen_rows)] = -np.inf
+        scores[title_index.rows_of_ids(movie_ids[candidates]) < 0] = -np.inf
+        top = np.argsort(-scores, kind='stable')[:top_n]
+        top_indexes = candidates[top[np.isfinite(scores[top])]]
+    # Movies missing from the index get popular movies of the same genres
+    top_ids = movie_ids[top_indexes]
+    if len(top_ids) < top_n:
+        with span('popularity_fallback'):
+            top_ids = fill_with_popular(
+                load_popularity(), top_ids, top_n,
+                exclude=movie_ids[chosen_rows],
+                genres=genres_of(load_movies(), title_index.rows(movie_list)))
     # Appending the names of movies
-    top_50_indexes = list(listings.iloc[1:50].index)
-    # Removing chosen movies
-    top_indexes = np.setdiff1d(top_50_indexes,[idx_1,idx_2,idx_3])
-    for i in top_indexes[:top_n]:
-        recommended_movies.append(list(movies['title'])[i])
+    with span('materialise_titles'):
+        recommended_movies = title_index.titles_of_ids(top_ids)
     return recommended_movies
@@ -0,0 +1,372 @@
+"""
+
+    Offline top-K neighbour index for content-based filtering.
+
+    Author: Explore Data Science Academy.
+
+    Description: Builds, for every movie in `movies.csv`, the K most
+    similar movies under TF-IDF cosine similarity and stores them as
+    compact int32/float32 arrays. The similarity matrix is computed from
+    the sparse TF-IDF matrix one block of rows at a time, so the full
+    dense item-item matrix is never held in memory.
+
+    The fitted vectoriser and the sparse TF-IDF matrix are saved too.
+    When `movies.csv` changes, rebuilding reuses them: only movies that
+    are new or whose genres or title changed are transformed, with the
+    stored vocabulary. Use `--refit` to learn a fresh vocabulary.
+
+    With `--genome`, the MovieLens tag genome (`genome-scores.csv`, the
+    relevance of each of ~1,100 tags to each movie) is appended to the
+    TF-IDF vectors. Low relevances are dropped so the matrix stays
+    sparse, and `--components` optionally compresses the combined vectors
+    with a truncated SVD, keeping the similarity search fast.
+
+    Usage (from the root of the repository):
+
+        python -m recommenders.content_index
+        python -m recommenders.content_index --refit
+        python -m recommenders.content_index --genome --components 256
+
+"""
+# Script dependencies
+import argparse
+import os
+import pickle
+import time
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from utils.data_loader import file_digest, load_movies
+
+MOVIES_PATH = 'resources/data/movies.csv'
+INDEX_PATH = 'resources/models/content_neighbours.npz'
+FEATURES_PATH = 'resources/models/content_features.npz'
+VECTORISER_PATH = 'resources/models/content_vectoriser.pkl'
+# Not shipped with the app; download it from the MovieLens 25M data set
+GENOME_SCORES_PATH = 'resources/data/genome-scores.csv'
+
+
+def build_keywords(movies):
+    """Build the free-text description used to vectorise each movie.
+
+    Parameters
+    ----------
+    movies : Pandas Dataframe
+        Movie records with `title` and `genres` columns.
+
+    Returns
+    -------
+    Pandas Series
+        Space-separated genres followed by the movie title.
+
+    """
+    genres = movies['genres'].astype(object).fillna('')
+    genres = genres.str.replace('|', ' ', regex=False)
+    return genres + ' ' + movies['title'].fillna('')
+
+
+def top_k_neighbours(features, k=50, chunk_size=256):
+    """Find the top-k most similar rows of an L2-normalised matrix.
+
+    Parameters
+    ----------
+    features : scipy.sparse.csr_matrix or numpy.ndarray
+        Row-normalised item feature matrix.
+    k : int
+        Number of neighbours to keep per item.
+    chunk_size : int
+        Number of rows whose similarities are materialised at once.
+
+    Returns
+    -------
+    tuple (numpy.ndarray, numpy.ndarray)
+        Neighbour row indices (int32) and cosine scores (float32), both
+        of shape (n_items, k) and sorted by descending score.
+
+    """
+    n_items = features.shape[0]
+    k = min(k, n_items - 1)
+    features = features.astype(np.float32)
+    features_t = features.T.tocsr() if sparse.issparse(features) else features.T
+    neighbours = np.empty((n_items, k), dtype=np.int32)
+    scores = np.empty((n_items, k), dtype=np.float32)
+    for start in range(0, n_items, chunk_size):
+        stop = min(start + chunk_size, n_items)
+        block = features[start:stop] @ features_t
+        if sparse.issparse(block):
+            block = block.toarray()
+        # An item is never its own neighbour
+        block[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+        top = np.argpartition(block, -k, axis=1)[:, -k:]
+        top_scores = np.take_along_axis(block, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        neighbours[start:stop] = np.take_along_axis(top, order, axis=1)
+        scores[start:stop] = np.take_along_axis(top_scores, order, axis=1)
+    return neighbours, scores
+
+
+def build_features(movies, previous=None):
+    """Vectorise movies with TF-IDF, reusing earlier features where possible.
+
+    Parameters
+    ----------
+    movies : Pandas Dataframe
+        Movie records with `movieId`, `title` and `genres` columns.
+    previous : dict, optional
+        Features returned by an earlier call (or `load_features`). Its
+        vectoriser is reused, and only movies that are new or whose
+        keywords changed are transformed. A new vectoriser is fitted on
+        every movie if None.
+
+    Returns
+    -------
+    dict
+        `vectoriser`: the fitted TfidfVectorizer, `features`: the
+        float32 CSR matrix with one row per movie, `movie_ids`, and
+        `digests`: a hash of each movie's keywords.
+
+    """
+    keywords = build_keywords(movies)
+    movie_ids = movies['movieId'].to_numpy(dtype=np.int32)
+    digests = pd.util.hash_pandas_object(keywords, index=False).to_numpy()
+    if previous is None:
+        # Imported here so that the app, which only reads the index, never
+        # has to load scikit-learn
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        vectoriser = TfidfVectorizer(ngram_range=(1, 3), dtype=np.float32)
+        features = vectoriser.fit_transform(keywords)
+    else:
+        vectoriser = previous['vectoriser']
+        old_rows = pd.Index(previous['movie_ids']).get_indexer(movie_ids)
+        unchanged = old_rows >= 0
+        unchanged[unchanged] = previous['digests'][old_rows[unchanged]] == digests[unchanged]
+        changed = np.flatnonzero(~unchanged)
+        # Stack the reused rows and the transformed ones, then restore
+        # the catalogue order
+        stacked = sparse.vstack([previous['features'][old_rows[unchanged]],
+                                 vectoriser.transform(keywords.iloc[changed])],
+                                format='csr')
+        order = np.concatenate([np.flatnonzero(unchanged), changed])
+        features = stacked[np.argsort(order)]
+        print(f"Transformed {len(changed)} new or changed movies.")
+    return {'vectoriser': vectoriser,
+            'features': features.astype(np.float32),
+            'movie_ids': movie_ids,
+            'digests': digests}
+
+
+def save_features(features, path=FEATURES_PATH, vectoriser_path=VECTORISER_PATH):
+    """Save the TF-IDF matrix as a compressed `.npz`, and the vectoriser."""
+    sparse.save_npz(path, features['features'], compressed=True)
+    with open(vectoriser_path, 'wb') as f:
+        pickle.dump({name: features[name]
+                     for name in ['vectoriser', 'movie_ids', 'digests']}, f)
+
+
+def load_features(path=FEATURES_PATH, vectoriser_path=VECTORISER_PATH):
+    """Load features saved by `save_features`, or None if there are none."""
+    if not (os.path.exists(path) and os.path.exists(vectoriser_path)):
+        return None
+    with open(vectoriser_path, 'rb') as f:
+        features = pickle.load(f)
+    features['features'] = sparse.load_npz(path).tocsr()
+    return features
+
+
+def genome_features(movie_ids, path=GENOME_SCORES_PATH, min_relevance=0.3,
+                    chunk_size=1000000):
+    """Read tag genome relevances into a sparse movie x tag matrix.
+
+    Parameters
+    ----------
+    movie_ids : numpy.ndarray (int)
+        MovieLens Movie IDs giving the order of the rows.
+    path : str
+        Location of `genome-scores.csv` (movieId, tagId, relevance).
+    min_relevance : float
+        Relevances below this are dropped. Most of the genome is close to
+        zero, so this keeps the matrix sparse.
+    chunk_size : int
+        Number of rows parsed at once.
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        float32 matrix of shape (len(movie_ids), n_tags). Movies without
+        genome scores have empty rows.
+
+    """
+    movie_rows = pd.Index(movie_ids)
+    rows, columns, values = [], [], []
+    chunks = pd.read_csv(path, dtype={'movieId': np.int32, 'tagId': np.int32,
+                                      'relevance': np.float32},
+                         chunksize=chunk_size)
+    for chunk in chunks:
+        chunk = chunk[chunk['relevance'] >= min_relevance]
+        found = movie_rows.get_indexer(chunk['movieId'])
+        rows.append(found[found >= 0])
+        columns.append(chunk['tagId'].to_numpy()[found >= 0] - 1)
+        values.append(chunk['relevance'].to_numpy()[found >= 0])
+    columns = np.concatenate(columns)
+    return sparse.csr_matrix(
+        (np.concatenate(values), (np.concatenate(rows), columns)),
+        shape=(len(movie_ids), columns.max() + 1 if len(columns) else 0),
+        dtype=np.float32)
+
+
+def combine_features(tfidf, genome, genome_weight=1.0, n_components=None, seed=0):
+    """Append genome tag relevances to the TF-IDF vectors.
+
+    Parameters
+    ----------
+    tfidf : scipy.sparse.csr_matrix
+        Row-normalised TF-IDF features.
+    genome : scipy.sparse.csr_matrix
+        Tag relevances of the same movies, from `genome_features`.
+    genome_weight : float
+        Weight of the genome block relative to the TF-IDF block, once
+        both are row-normalised.
+    n_components : int, optional
+        If given, reduce the combined vectors to this many dimensions with
+        a truncated SVD.
+    seed : int
+        Seed of the truncated SVD.
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix or numpy.ndarray
+        Row-normalised float32 features; dense if reduced.
+
+    """
+    from sklearn.decomposition import TruncatedSVD
+    from sklearn.preprocessing import normalize
+    combined = sparse.hstack([tfidf, genome_weight * normalize(genome)],
+                             format='csr', dtype=np.float32)
+    if n_components:
+        svd = TruncatedSVD(n_components, random_state=seed)
+        combined = svd.fit_transform(combined).astype(np.float32)
+        print(f"Reduced features to {n_components} dimensions "
+              f"({svd.explained_variance_ratio_.sum():.1%} of the variance).")
+    return normalize(combined)
+
+
+def build_content_index(movies, k=50, chunk_size=256, features=None):
+    """Vectorise movies with TF-IDF and compute their neighbour lists.
+
+    Parameters
+    ----------
+    movies : Pandas Dataframe
+        Movie records with `movieId`, `title` and `genres` columns.
+    k : int
+        Number of neighbours to keep per movie.
+    chunk_size : int
+        Number of rows whose similarities are materialised at once.
+    features : dict, optional
+        Features of `movies` from `build_features`; built if None. An
+        optional `combined` entry (see `combine_features`) is searched
+        instead of the TF-IDF matrix.
+
+    Returns
+    -------
+    dict
+        `movie_ids`, `neighbours` and `scores` arrays.
+
+    """
+    if features is None:
+        features = build_features(movies)
+    neighbours, scores = top_k_neighbours(
+        features.get('combined', features['features']), k, chunk_size)
+    return {'movie_ids': features['movie_ids'],
+            'neighbours': neighbours,
+            'scores': scores}
+
+
+def save_content_index(index, path=INDEX_PATH, source_digest=None):
+    """Write a neighbour index to an uncompressed `.npz` archive.
+
+    Parameters
+    ----------
+    index : dict
+        Index built by `build_content_index`.
+    path : str
+        Location of the `.npz` archive.
+    source_digest : str, optional
+        Digest of the `movies.csv` the index was built from, stored so
+        that a stale index can be detected.
+
+    """
+    if source_digest is not None:
+        index = {**index, 'source_digest': np.array(source_digest)}
+    np.savez(path, **index)
+
+
+def load_content_index(path=INDEX_PATH):
+    """Load a neighbour index written by `save_content_index`.
+
+    Parameters
+    ----------
+    path : str
+        Location of the `.npz` archive.
+
+    Returns
+    -------
+    dict
+        `movie_ids`, `neighbours` and `scores` arrays, and the
+        `source_digest` of the movies if it was saved.
+
+    """
+    with np.load(path) as archive:
+        return {name: archive[name] for name in archive.files}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('Usage')[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--movies', default=MOVIES_PATH)
+    parser.add_argument('--output', default=INDEX_PATH)
+    parser.add_argument('-k', type=int, default=50,
+                        help='Neighbours stored per movie.')
+    parser.add_argument('--chunk-size', type=int, default=256,
+                        help='Rows of the similarity matrix computed at once.')
+    parser.add_argument('--features', default=FEATURES_PATH,
+                        help='Where the TF-IDF matrix is kept.')
+    parser.add_argument('--vectoriser', default=VECTORISER_PATH,
+                        help='Where the fitted vectoriser is kept.')
+    parser.add_argument('--refit', action='store_true',
+                        help='Fit a new vectoriser instead of reusing the saved one.')
+    parser.add_argument('--genome', action='store_true',
+                        help='Add tag genome relevances to the features.')
+    parser.add_argument('--genome-scores', default=GENOME_SCORES_PATH)
+    parser.add_argument('--genome-weight', type=float, default=1.0,
+                        help='Weight of the tag genome relative to TF-IDF.')
+    parser.add_argument('--min-relevance', type=float, default=0.3,
+                        help='Tag relevances below this are dropped.')
+    parser.add_argument('--components', type=int,
+                        help='With --genome, reduce the features to this '
+                             'many dimensions.')
+    args = parser.parse_args()
+    if args.genome and not os.path.exists(args.genome_scores):
+        parser.error(f'{args.genome_scores} not found; download it from the '
+                     'MovieLens 25M data set.')
+
+    start = time.time()
+    movies = load_movies(args.movies)
+    previous = None if args.refit else load_features(args.features, args.vectoriser)
+    features = build_features(movies, previous)
+    save_features(features, args.features, args.vectoriser)
+    if args.genome:
+        genome = genome_features(features['movie_ids'], args.genome_scores,
+                                 args.min_relevance)
+        print(f"Read tag genome of {genome.getnnz(axis=1).astype(bool).sum()} movies.")
+        features['combined'] = combine_features(
+            features['features'], genome, args.genome_weight, args.components)
+    index = build_content_index(movies, args.k, args.chunk_size, features)
+    save_content_index(index, args.output, source_digest=file_digest(args.movies))
+    print(f"Indexed {len(movies)} movies in {time.time() - start:.1f}s. "
+          f"Saved to: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -7,34 +7,434 @@
     Description: Simple script to train and save an instance of the
     SVDpp algorithm on MovieLens data.
 
+    Besides a full training run, the script can fold a delta of new
+    ratings into an existing model: new users and items are added to the
+    factor matrices, and a few SGD epochs are run over the new ratings
+    only, so the cost scales with the size of the delta rather than the
+    whole rating history. Every saved model is also archived under a
+    versioned file name.
+
+    A streaming mode trains from scratch without ever loading the ratings
+    into a Dataframe: the ratings are read in chunks into a sparse
+    user-item matrix, and the SVD is fitted with mini-batch SGD over the
+    entries of that matrix.
+
+    A sweep mode cross-validates a grid of hyperparameters across a pool
+    of worker processes, records RMSE, MAE and wall time per
+    configuration, and saves a model trained with the best one.
+
+    Alongside every saved model an approximate nearest-neighbour index
+    over its item factors is written to `<model>.ann.npz`, which the
+    collaborative recommender uses to find movies near a user's
+    favourites. The model's factors, biases and id maps are also exported
+    as memory-mappable float32 arrays to `<model>.factors/`, which the
+    recommender loads instead of unpickling the model.
+
+    Usage:
+
+        python train_colbased.py
+        python train_colbased.py --delta new_ratings.csv
+        python train_colbased.py --streaming --chunk-size 1000000
+        python train_colbased.py --sweep --jobs 8
+
 """
 # Script dependencies
+import argparse
+import glob
+import itertools
+import multiprocessing
+import os
+import re
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
 from surprise import SVD
 import surprise
 import pickle
 
-# Importing datasets
-ratings = pd.read_csv('ratings.csv')
-ratings.drop('timestamp',axis=1,inplace=True)
+# Make the app's helper modules importable when run from resources/models
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+from utils.ann import build_ivf_index, save_ivf_index
+from utils.data_loader import file_digest
+from utils.model_export import export_factors, factors_path
+from utils.rating_matrix import read_rating_matrix
 
-def svd_pp(save_path):
+MODEL_PATH = 'team2_SVD_recommender.pkl'
+SWEEP_RESULTS_PATH = 'svd_sweep_results.csv'
+
+# Configuration used for a full training run
+SVD_PARAMS = {'n_factors': 200, 'lr_all': 0.005, 'reg_all': 0.02,
+              'n_epochs': 40, 'init_std_dev': 0.05}
+# Hyperparameters explored by the sweep
+PARAM_GRID = {'n_factors': [50, 100, 200],
+              'lr_all': [0.002, 0.005, 0.01],
+              'reg_all': [0.02, 0.05, 0.1],
+              'n_epochs': [20, 40]}
+
+def load_ratings(path):
+    # Importing datasets
+    ratings = pd.read_csv(path)
+    ratings.drop('timestamp',axis=1,inplace=True,errors='ignore')
+    return ratings
+
+def _reader(ratings):
     # Check the range of the rating
     min_rat = ratings['rating'].min()
     max_rat = ratings['rating'].max()
     # Changing ratings to their standard form
-    reader = surprise.Reader(rating_scale = (min_rat, max_rat))
+    return surprise.Reader(rating_scale = (min_rat, max_rat))
+
+def svd_pp(save_path, ratings_path='ratings.csv', params=SVD_PARAMS):
+    ratings = load_ratings(ratings_path)
     # Loading the data frame using surprise
-    data_load = surprise.Dataset.load_from_df(ratings, reader)
+    data_load = surprise.Dataset.load_from_df(ratings, _reader(ratings))
     # Instantiating surprise
-    method = SVD(n_factors = 200 , lr_all = 0.005 , reg_all = 0.02 , n_epochs = 40 , init_std_dev = 0.05)
-    # method = SVD(n_factors = 200 , lr_all = 0.005 , reg_all = 0.02 , n_epochs = 40 , init_std_dev = 0.05)
+    method = SVD(**params)
     # Loading a trainset into the model
     model = method.fit(data_load.build_full_trainset())
     print (f"Training completed. Saving model to: {save_path}")
 
-    return pickle.dump(model, open(save_path,'wb'))
+    return save_versioned(model, save_path)
+
+def svd_from_matrix(rating_matrix, params=SVD_PARAMS, seed=0):
+    """Fit an SVD model on the entries of a sparse rating matrix.
+
+    The model is fitted with `sgd_epochs` rather than surprise's own
+    trainer, which needs the ratings as a Dataframe and then as Python
+    lists. Its trainset holds the id mappings, counts and global mean the
+    app and `update_svd` use, but not the ratings themselves.
+
+    Parameters
+    ----------
+    rating_matrix : RatingMatrix
+        Ratings, e.g. from `utils.rating_matrix.read_rating_matrix`.
+    params : dict
+        SVD hyperparameters.
+    seed : int
+        Seed for the initial factors and the order of the SGD updates.
+
+    Returns
+    -------
+    surprise.SVD
+        The fitted model.
+
+    """
+    matrix = rating_matrix.matrix
+    n_users, n_items = matrix.shape
+    model = SVD(random_state=seed, **params)
+    trainset = surprise.Trainset(
+        # Membership tests (`knows_user`/`knows_item`) are all that is
+        # needed of the per-user and per-item rating lists
+        ur=range(n_users), ir=range(n_items),
+        n_users=n_users, n_items=n_items, n_ratings=matrix.nnz,
+        rating_scale=(float(matrix.data.min()), float(matrix.data.max())),
+        raw2inner_id_users={raw: inner for inner, raw in enumerate(rating_matrix.user_ids.tolist())},
+        raw2inner_id_items={raw: inner for inner, raw in enumerate(rating_matrix.item_ids.tolist())})
+    trainset._global_mean = float(matrix.data.mean(dtype=np.float64))
+    model.trainset = trainset
+    rng = np.random.RandomState(seed)
+    model.pu = rng.normal(model.init_mean, model.init_std_dev, (n_users, model.n_factors))
+    model.qi = rng.normal(model.init_mean, model.init_std_dev, (n_items, model.n_factors))
+    model.bu, model.bi = np.zeros(n_users), np.zeros(n_items)
+    # One (user, item, rating) triple per stored entry of the matrix
+    users = np.repeat(np.arange(n_users, dtype=np.int32), np.diff(matrix.indptr))
+    sgd_epochs(model, users, matrix.indices, matrix.data, model.n_epochs, seed=seed)
+    return model
+
+def svd_streaming(save_path, ratings_path='ratings.csv', params=SVD_PARAMS,
+                  chunk_size=1000000):
+    """Train and save a model without loading the ratings into a Dataframe."""
+    rating_matrix = read_rating_matrix(ratings_path, chunk_size)
+    print(f"Read {rating_matrix.matrix.nnz} ratings of "
+          f"{len(rating_matrix.user_ids)} users and {len(rating_matrix.item_ids)} items.")
+    model = svd_from_matrix(rating_matrix, params)
+    print (f"Training completed. Saving model to: {save_path}")
+    return save_versioned(model, save_path)
+
+# Ratings and fold assignments shared with sweep workers. Under the 'fork'
+# start method workers inherit these pages copy-on-write, so the ratings
+# are never pickled or copied per worker.
+_sweep_ratings = None
+_sweep_folds = None
+
+def _init_sweep_worker(ratings, folds):
+    global _sweep_ratings, _sweep_folds
+    _sweep_ratings, _sweep_folds = ratings, folds
+
+def _evaluate_fold(task):
+    """Train on all folds but one and score the held-out fold."""
+    params, fold = task
+    start = time.time()
+    train = _sweep_ratings[_sweep_folds != fold]
+    test = _sweep_ratings[_sweep_folds == fold]
+    data_load = surprise.Dataset.load_from_df(train, _reader(_sweep_ratings))
+    model = SVD(random_state=fold, **{**SVD_PARAMS, **params}).fit(data_load.build_full_trainset())
+    predictions = model.test(list(test.itertuples(index=False, name=None)))
+    return {**params, 'fold': fold,
+            'rmse': surprise.accuracy.rmse(predictions, verbose=False),
+            'mae': surprise.accuracy.mae(predictions, verbose=False),
+            'seconds': time.time() - start}
+
+def sweep(ratings_path, save_path, results_path=SWEEP_RESULTS_PATH,
+          param_grid=PARAM_GRID, n_folds=5, n_jobs=None):
+    """Cross-validate a grid of SVD hyperparameters in parallel.
+
+    Every (configuration, fold) pair is trained in its own worker process.
+    Parameters missing from the grid keep their `SVD_PARAMS` values.
+    Per-configuration means of RMSE, MAE and wall time are written to
+    `results_path`, and a model trained on all ratings with the best
+    configuration (lowest RMSE) is saved to `save_path`.
+
+    Parameters
+    ----------
+    ratings_path : str
+        Ratings to cross-validate on.
+    save_path : str
+        Where to save the best model.
+    results_path : str
+        Where to write the per-configuration results, as .csv.
+    param_grid : dict
+        Candidate values of each SVD hyperparameter.
+    n_folds : int
+        Number of cross-validation folds.
+    n_jobs : int, optional
+        Worker processes; defaults to every available core.
+
+    Returns
+    -------
+    Pandas Dataframe
+        Per-configuration results, best first.
+
+    """
+    global _sweep_ratings, _sweep_folds
+    _sweep_ratings = load_ratings(ratings_path)
+    _sweep_folds = np.random.RandomState(0).permutation(len(_sweep_ratings)) % n_folds
+    names = list(param_grid)
+    configs = [dict(zip(names, values)) for values in itertools.product(*param_grid.values())]
+    tasks = [(params, fold) for params in configs for fold in range(n_folds)]
+    if 'fork' in multiprocessing.get_all_start_methods():
+        pool = ProcessPoolExecutor(n_jobs, mp_context=multiprocessing.get_context('fork'))
+    else:
+        # Without fork every worker receives its own copy of the ratings
+        pool = ProcessPoolExecutor(n_jobs, initializer=_init_sweep_worker,
+                                   initargs=(_sweep_ratings, _sweep_folds))
+    start = time.time()
+    with pool:
+        folds = pd.DataFrame(pool.map(_evaluate_fold, tasks))
+    results = (folds.groupby(names, as_index=False)[['rmse', 'mae', 'seconds']].mean()
+                    .sort_values('rmse').reset_index(drop=True))
+    results.to_csv(results_path, index=False)
+    print(f"Evaluated {len(configs)} configurations x {n_folds} folds in "
+          f"{time.time() - start:.1f}s. Results saved to: {results_path}")
+    best = {name: results.loc[0, name].item() for name in names}
+    print(f"Best configuration: {best} (RMSE {results.loc[0, 'rmse']:.4f})")
+    data_load = surprise.Dataset.load_from_df(_sweep_ratings, _reader(_sweep_ratings))
+    model = SVD(**{**SVD_PARAMS, **best}).fit(data_load.build_full_trainset())
+    save_versioned(model, save_path)
+    return results
+
+def _add_ids(raw2inner, raw_ids):
+    """Assign inner ids to raw ids not yet known to the model."""
+    new_ids = [raw_id for raw_id in pd.unique(raw_ids) if raw_id not in raw2inner]
+    for raw_id in new_ids:
+        raw2inner[raw_id] = len(raw2inner)
+    return len(new_ids)
+
+def _grow(model, factors, biases, n_new):
+    """Append freshly initialised rows for new users or items."""
+    rng = np.random.RandomState(model.random_state if isinstance(model.random_state, int) else None)
+    new_factors = rng.normal(model.init_mean, model.init_std_dev, (n_new, model.n_factors))
+    return np.vstack([factors, new_factors]), np.concatenate([biases, np.zeros(n_new)])
+
+def sgd_epochs(model, users, items, ratings, n_epochs, batch_size=1024, seed=0):
+    """Run SGD epochs of the SVD objective over the given ratings only.
+
+    Updates are applied in mini-batches, accumulating the gradients of
+    repeated users and items within a batch, so each epoch is a handful of
+    array operations rather than one Python step per rating.
+
+    Parameters
+    ----------
+    model : surprise.SVD
+        Model whose factors and biases are updated in place.
+    users, items : numpy.ndarray (int)
+        Inner user and item ids of each rating.
+    ratings : numpy.ndarray (float)
+        Rating values.
+    n_epochs : int
+        Number of passes over the ratings.
+    batch_size : int
+        Ratings per mini-batch.
+    seed : int
+        Seed for shuffling the ratings each epoch.
+
+    """
+    rng = np.random.RandomState(seed)
+    mean = model.trainset.global_mean if model.biased else 0.0
+    pu, qi, bu, bi = model.pu, model.qi, model.bu, model.bi
+    for _ in range(n_epochs):
+        order = rng.permutation(len(ratings))
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            u, i, r = users[batch], items[batch], ratings[batch]
+            est = mean + np.einsum('ij,ij->i', pu[u], qi[i])
+            if model.biased:
+                est += bu[u] + bi[i]
+            err = r - est
+            if model.biased:
+                np.add.at(bu, u, model.lr_bu * (err - model.reg_bu * bu[u]))
+                np.add.at(bi, i, model.lr_bi * (err - model.reg_bi * bi[i]))
+            grad_pu = model.lr_pu * (err[:, np.newaxis] * qi[i] - model.reg_pu * pu[u])
+            grad_qi = model.lr_qi * (err[:, np.newaxis] * pu[u] - model.reg_qi * qi[i])
+            np.add.at(pu, u, grad_pu)
+            np.add.at(qi, i, grad_qi)
+
+def _register_ratings(trainset, users, items, ratings):
+    """Record new ratings in the per-user and per-item rating lists.
+
+    Surprise decides whether a user or item is known (and so whether
+    `predict` uses its factors) from these lists.
+
+    """
+    if isinstance(trainset.ur, range):
+        # Trainsets built by `svd_from_matrix` only track membership
+        trainset.ur, trainset.ir = range(trainset.n_users), range(trainset.n_items)
+        return
+    for u, i, r in zip(users, items, ratings):
+        trainset.ur[u].append((i, r))
+        trainset.ir[i].append((u, r))
+
+def update_svd(model, delta, n_epochs=5):
+    """Fold a delta of new ratings into a trained SVD model.
+
+    Parameters
+    ----------
+    model : surprise.SVD
+        Trained model, updated in place.
+    delta : Pandas Dataframe
+        New ratings with `userId`, `movieId` and `rating` columns.
+    n_epochs : int
+        SGD epochs run over the delta.
+
+    Returns
+    -------
+    surprise.SVD
+        The updated model.
+
+    """
+    trainset = model.trainset
+    # Register new users and items, with freshly initialised factors
+    n_new_users = _add_ids(trainset._raw2inner_id_users, delta['userId'])
+    n_new_items = _add_ids(trainset._raw2inner_id_items, delta['movieId'])
+    model.pu, model.bu = _grow(model, model.pu, model.bu, n_new_users)
+    model.qi, model.bi = _grow(model, model.qi, model.bi, n_new_items)
+    trainset.n_users += n_new_users
+    trainset.n_items += n_new_items
+    trainset._inner2raw_id_users = None
+    trainset._inner2raw_id_items = None
+    # Keep the global mean consistent with the enlarged rating history
+    n_ratings = trainset.n_ratings + len(delta)
+    trainset._global_mean = (trainset.global_mean * trainset.n_ratings
+                             + delta['rating'].sum()) / n_ratings
+    trainset.n_ratings = n_ratings
+    # Train over the affected rows only
+    users = delta['userId'].map(trainset._raw2inner_id_users).to_numpy()
+    items = delta['movieId'].map(trainset._raw2inner_id_items).to_numpy()
+    ratings = delta['rating'].to_numpy(dtype=float)
+    _register_ratings(trainset, users, items, ratings)
+    if not all(map(trainset.knows_user, np.unique(users))) \
+            or not all(map(trainset.knows_item, np.unique(items))):
+        raise RuntimeError("Folded-in users or items are unknown to the trainset.")
+    sgd_epochs(model, users, items, ratings, n_epochs)
+    print(f"Folded in {len(delta)} ratings ({n_new_users} new users, "
+          f"{n_new_items} new items).")
+    return model
+
+def item_index_path(model_path):
+    """Location of the item-factor ANN index saved next to a model."""
+    return os.path.splitext(model_path)[0] + '.ann.npz'
+
+def save_item_index(model, model_path):
+    """Build and save an ANN index over the item factors of a model."""
+    trainset = model.trainset
+    item_ids = np.array([trainset.to_raw_iid(i) for i in trainset.all_items()])
+    index = build_ivf_index(model.qi, item_ids)
+    save_ivf_index(index, item_index_path(model_path))
+    print(f"Saved item index over {len(item_ids)} items to: {item_index_path(model_path)}")
+
+def save_versioned(model, save_path):
+    """Pickle a model under the next version number and as `save_path`.
+
+    Parameters
+    ----------
+    model : surprise.SVD
+        Model to save.
+    save_path : str
+        Path the app loads the current model from.
+
+    Returns
+    -------
+    str
+        Path of the versioned copy, e.g. `team2_SVD_recommender.v3.pkl`.
+
+    """
+    stem, ext = os.path.splitext(save_path)
+    pattern = re.compile(re.escape(stem) + r'\.v(\d+)' + re.escape(ext) + '$')
+    versions = [int(m.group(1)) for m in map(pattern.match, glob.glob(f'{stem}.v*{ext}')) if m]
+    versioned_path = f'{stem}.v{max(versions, default=0) + 1}{ext}'
+    with open(versioned_path, 'wb') as f:
+        pickle.dump(model, f)
+    # Replace the current model atomically, so readers never see a partial file
+    shutil.copyfile(versioned_path, save_path + '.tmp')
+    os.replace(save_path + '.tmp', save_path)
+    print(f"Saved model version: {versioned_path}")
+    export_factors(model, factors_path(save_path), source_digest=file_digest(save_path))
+    print(f"Exported factors to: {factors_path(save_path)}")
+    save_item_index(model, save_path)
+    return versioned_path
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('Usage')[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ratings', default='ratings.csv',
+                        help='Ratings to train on from scratch.')
+    parser.add_argument('--delta',
+                        help='New ratings to fold into the existing model.')
+    parser.add_argument('--model', default=MODEL_PATH,
+                        help='Model to update, and where to save the result.')
+    parser.add_argument('--epochs', type=int, default=5,
+                        help='SGD epochs over the delta.')
+    parser.add_argument('--streaming', action='store_true',
+                        help='Train from a sparse matrix read in chunks.')
+    parser.add_argument('--chunk-size', type=int, default=1000000,
+                        help='Ratings read at once in streaming mode.')
+    parser.add_argument('--sweep', action='store_true',
+                        help='Cross-validate the hyperparameter grid.')
+    parser.add_argument('--folds', type=int, default=5,
+                        help='Cross-validation folds used by the sweep.')
+    parser.add_argument('--jobs', type=int,
+                        help='Sweep worker processes (default: all cores).')
+    parser.add_argument('--results', default=SWEEP_RESULTS_PATH,
+                        help='Where the sweep writes its results.')
+    args = parser.parse_args()
+
+    if args.sweep:
+        sweep(args.ratings, args.model, args.results, n_folds=args.folds,
+              n_jobs=args.jobs)
+        return
+    if args.delta is None and args.streaming:
+        svd_streaming(args.model, args.ratings, chunk_size=args.chunk_size)
+        return
+    if args.delta is None:
+        svd_pp(args.model, args.ratings)
+        return
+    with open(args.model, 'rb') as f:
+        model = pickle.load(f)
+    update_svd(model, load_ratings(args.delta), args.epochs)
+    save_versioned(model, args.model)
 
 if __name__ == '__main__':
-    svd_pp('team2_SVD_recommender.pkl')
+    main()
@@ -0,0 +1,117 @@
+"""
+
+    Approximate nearest-neighbour search over item vectors.
+
+    Author: Explore Data Science Academy.
+
+    Description: A small inverted-file (IVF) index written in NumPy. Item
+    vectors are normalised and clustered with spherical k-means; each
+    query is then compared with the cluster centroids, and only the items
+    of the `n_probe` closest clusters are scored. With about sqrt(n)
+    clusters a lookup touches a small fraction of the catalogue, so its
+    cost grows sub-linearly with the number of items.
+
+"""
+# Data handling dependencies
+import numpy as np
+
+
+def _normalise(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors),
+                     where=norms > 0)
+
+
+def build_ivf_index(vectors, ids, n_lists=None, n_iter=10, seed=0):
+    """Cluster item vectors into an inverted-file index.
+
+    Parameters
+    ----------
+    vectors : numpy.ndarray
+        Item vectors of shape (n_items, n_dims), e.g. SVD item factors.
+    ids : numpy.ndarray
+        Identifier of each item, returned by searches.
+    n_lists : int, optional
+        Number of clusters; defaults to sqrt(n_items).
+    n_iter : int
+        Spherical k-means iterations.
+    seed : int
+        Seed for choosing the initial centroids.
+
+    Returns
+    -------
+    dict
+        `centroids`, `offsets`, `vectors` and `ids` arrays. Items are
+        stored grouped by cluster: the items of cluster c are
+        `vectors[offsets[c]:offsets[c + 1]]`.
+
+    """
+    vectors = _normalise(vectors)
+    n_items = len(vectors)
+    n_lists = min(n_lists or max(1, int(np.sqrt(n_items))), n_items)
+    rng = np.random.RandomState(seed)
+    centroids = vectors[rng.choice(n_items, n_lists, replace=False)]
+    for _ in range(n_iter):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        # Empty clusters keep their previous centroid
+        empty = ~sums.any(axis=1)
+        sums[empty] = centroids[empty]
+        centroids = _normalise(sums)
+    assignment = np.argmax(vectors @ centroids.T, axis=1)
+    order = np.argsort(assignment, kind='stable')
+    offsets = np.zeros(n_lists + 1, dtype=np.int64)
+    np.cumsum(np.bincount(assignment, minlength=n_lists), out=offsets[1:])
+    return {'centroids': centroids,
+            'offsets': offsets,
+            'vectors': vectors[order],
+            'ids': np.asarray(ids)[order]}
+
+
+def save_ivf_index(index, path):
+    """Write an index to an uncompressed `.npz` archive."""
+    np.savez(path, **index)
+
+
+def vectors_of(index, ids):
+    """Stored (normalised) vectors of the given items, skipping unknown ids."""
+    return index['vectors'][np.isin(index['ids'], ids)]
+
+
+def search(index, queries, k=10, n_probe=16):
+    """Find the items with the highest cosine similarity to each query.
+
+    Parameters
+    ----------
+    index : dict
+        Index built by `build_ivf_index`.
+    queries : numpy.ndarray
+        Query vectors of shape (n_queries, n_dims).
+    k : int
+        Number of results per query.
+    n_probe : int
+        Number of clusters scanned per query. Higher is more accurate and
+        slower; scanning every cluster is an exact search.
+
+    Returns
+    -------
+    list (tuple (numpy.ndarray, numpy.ndarray))
+        For each query, the ids of its nearest items and their cosine
+        similarities, best first.
+
+    """
+    queries = _normalise(np.atleast_2d(queries))
+    offsets = index['offsets']
+    n_probe = min(n_probe, len(index['centroids']))
+    probes = np.argpartition(-(queries @ index['centroids'].T),
+                             n_probe - 1, axis=1)[:, :n_probe]
+    results = []
+    for query, lists in zip(queries, probes):
+        candidates = np.concatenate([np.arange(offsets[c], offsets[c + 1])
+                                     for c in lists])
+        scores = index['vectors'][candidates] @ query
+        top = np.argsort(-scores, kind='stable')[:k]
+        results.append((index['ids'][candidates[top]], scores[top]))
+    return results
@@ -0,0 +1,99 @@
+"""
+
+    Background execution of recommendation requests.
+
+    Author: Explore Data Science Academy.
+
+    Description: Recommendations are computed on a worker pool shared by
+    every Streamlit session served by the process, so that a slow request
+    never ties up more than a bounded number of threads, and the app can
+    stop waiting for it after a latency budget and show a fallback answer
+    instead.
+
+    Requests run with a copy of the submitting thread's context variables,
+    so per-session settings such as `instrumentation.collect` follow them
+    onto the pool.
+
+    Each session has at most one request in flight. It is remembered in
+    the session's state together with the request's key, so that a rerun
+    asking for the same recommendations picks up the running request
+    rather than starting another one, and a request whose selection has
+    since changed is cancelled. Python threads cannot be interrupted, so
+    cancelling only stops requests that have not started yet; a request
+    that is already running finishes and fills the result cache.
+
+    `RECOMMENDER_WORKERS` sets the size of the pool (4 by default).
+
+"""
+# Script dependencies
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+# Shared by every Streamlit session served by this process
+executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('RECOMMENDER_WORKERS', 4)),
+    thread_name_prefix='recommender')
+
+_PENDING = 'pending_recommendation'
+
+
+def submit(state, key, func, *args, **kwargs):
+    """Run `func(*args, **kwargs)` on the pool as the session's request.
+
+    Parameters
+    ----------
+    state : MutableMapping
+        State of the session, e.g. `st.session_state`.
+    key : hashable
+        Identifies the request; a pending request with the same key is
+        reused instead of submitting a new one.
+    func : callable
+        Function to run.
+
+    Returns
+    -------
+    concurrent.futures.Future
+        The request.
+
+    """
+    pending = state.get(_PENDING)
+    if pending is not None:
+        if pending[0] == key:
+            return pending[1]
+        pending[1].cancel()
+    future = executor.submit(contextvars.copy_context().run, func, *args, **kwargs)
+    state[_PENDING] = (key, future)
+    return future
+
+
+def cancel_stale(state, key):
+    """Cancel the session's request unless it is for `key`."""
+    pending = state.get(_PENDING)
+    if pending is not None and pending[0] != key:
+        pending[1].cancel()
+        del state[_PENDING]
+
+
+def wait(state, future, timeout):
+    """Wait up to `timeout` seconds for a request submitted with `submit`.
+
+    Returns
+    -------
+    tuple (bool, object)
+        Whether the request finished, and its result (None if not).
+
+    Raises
+    ------
+    Exception
+        Whatever the request raised.
+
+    """
+    try:
+        result = future.result(timeout=timeout)
+    except TimeoutError:
+        return False, None
+    finally:
+        if future.done() and state.get(_PENDING, (None, None))[1] is future:
+            del state[_PENDING]
+    return True, result
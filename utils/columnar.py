@@ -0,0 +1,209 @@
+"""
+
+    Columnar binary storage for movie and rating data.
+
+    Author: Explore Data Science Academy.
+
+    Description: Converts the .csv datasets into a directory holding one
+    `.npy` file per column, with compact dtypes (int32 ids, float32
+    ratings, categorical genres). Numeric columns are memory-mapped
+    read-only when loaded, so every worker process shares the same
+    page-cached copy of the data instead of parsing its own.
+
+    Strings are stored Arrow-style as a UTF-8 byte buffer plus offsets,
+    and categoricals as integer codes plus a string column of categories.
+    A `columns.json` manifest records the column layout and a digest of
+    the source .csv, so stale conversions can be detected.
+
+    Usage (from the root of the repository):
+
+        python -m utils.columnar
+
+"""
+# Data handling dependencies
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+MANIFEST = 'columns.json'
+FORMAT_VERSION = 1
+
+
+def columns_path(csv_path):
+    """Directory holding the columnar copy of a .csv file."""
+    return os.path.splitext(csv_path)[0] + '.columns'
+
+
+def _write_strings(directory, name, values):
+    encoded = [str(v).encode('utf-8') for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(v) for v in encoded], out=offsets[1:])
+    data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    np.save(os.path.join(directory, f'{name}.data.npy'), data)
+    np.save(os.path.join(directory, f'{name}.offsets.npy'), offsets)
+
+
+def _read_strings(directory, name):
+    data = np.load(os.path.join(directory, f'{name}.data.npy'))
+    offsets = np.load(os.path.join(directory, f'{name}.offsets.npy'))
+    buffer = data.tobytes()
+    values = np.empty(len(offsets) - 1, dtype=object)
+    values[:] = [buffer[start:stop].decode('utf-8')
+                 for start, stop in zip(offsets[:-1], offsets[1:])]
+    return values
+
+
+def write_columns(frame, directory, dtypes=None, categorical=(),
+                  source_digest=None):
+    """Write a Dataframe as one file per column.
+
+    Parameters
+    ----------
+    frame : Pandas Dataframe
+        Records to store.
+    directory : str
+        Output directory, created if needed.
+    dtypes : dict, optional
+        Numeric dtype to store each numeric column as.
+    categorical : sequence (str)
+        String columns to store as integer codes plus categories.
+    source_digest : str, optional
+        Digest of the file the records were read from.
+
+    """
+    dtypes = dtypes or {}
+    os.makedirs(directory, exist_ok=True)
+    layout = []
+    for name in frame.columns:
+        column = frame[name]
+        if name in categorical:
+            column = column.astype('category')
+            codes = column.cat.codes.to_numpy()
+            codes = codes.astype(np.int16 if len(column.cat.categories) < 2**15
+                                 else np.int32)
+            np.save(os.path.join(directory, f'{name}.npy'), codes)
+            _write_strings(directory, f'{name}.categories',
+                           column.cat.categories)
+            layout.append({'name': name, 'kind': 'category'})
+        elif column.dtype == object:
+            _write_strings(directory, name, column.to_numpy())
+            layout.append({'name': name, 'kind': 'string'})
+        else:
+            values = column.to_numpy(dtype=dtypes.get(name, column.dtype))
+            np.save(os.path.join(directory, f'{name}.npy'), values)
+            layout.append({'name': name, 'kind': 'numeric'})
+    manifest = {'version': FORMAT_VERSION, 'rows': len(frame),
+                'columns': layout, 'source_digest': source_digest}
+    # The manifest is written last, so a partial conversion is never read
+    with open(os.path.join(directory, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+
+def read_manifest(directory):
+    """Read the manifest of a columnar directory, or None if absent."""
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    if manifest.get('version') != FORMAT_VERSION:
+        return None
+    return manifest
+
+
+def read_arrays(directory, mmap_mode='r'):
+    """Load the columns written by `write_columns` as arrays.
+
+    Parameters
+    ----------
+    directory : str
+        Columnar directory.
+    mmap_mode : str, optional
+        Memory-map mode for numeric columns; None reads them into memory.
+
+    Returns
+    -------
+    dict
+        Numeric columns as (memory-mapped) arrays, string columns as object
+        arrays and categorical columns as `pandas.Categorical`.
+
+    """
+    manifest = read_manifest(directory)
+    arrays = {}
+    for column in manifest['columns']:
+        name = column['name']
+        if column['kind'] == 'string':
+            arrays[name] = _read_strings(directory, name)
+            continue
+        values = np.load(os.path.join(directory, f'{name}.npy'),
+                         mmap_mode=mmap_mode)
+        if column['kind'] == 'category':
+            categories = _read_strings(directory, f'{name}.categories')
+            values = pd.Categorical.from_codes(values, categories)
+        arrays[name] = values
+    return arrays
+
+
+def read_frame(directory):
+    """Load the columns written by `write_columns` as a Dataframe.
+
+    Numeric columns are not copied, so they stay memory-mapped.
+
+    """
+    return pd.DataFrame(read_arrays(directory), copy=False)
+
+
+def convert(csv_path, dtypes, categorical=()):
+    """Convert a .csv file into its columnar directory.
+
+    Parameters
+    ----------
+    csv_path : str
+        Relative or absolute path to the .csv file.
+    dtypes : dict
+        Dtype of each numeric column.
+    categorical : sequence (str)
+        String columns to store as categoricals.
+
+    Returns
+    -------
+    str
+        The columnar directory written.
+
+    """
+    # Imported here to avoid a circular import with the data loader
+    from utils.data_loader import file_digest
+    frame = pd.read_csv(csv_path, dtype=dtypes)
+    directory = columns_path(csv_path)
+    write_columns(frame, directory, dtypes, categorical,
+                  source_digest=file_digest(csv_path))
+    return directory
+
+
+def main():
+    from utils.data_loader import (MOVIES_DTYPES, MOVIES_PATH,
+                                   RATINGS_DTYPES, RATINGS_PATH)
+    parser = argparse.ArgumentParser(description=__doc__.split('Usage')[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--movies', default=MOVIES_PATH)
+    parser.add_argument('--ratings', default=RATINGS_PATH)
+    args = parser.parse_args()
+
+    jobs = [(args.movies, MOVIES_DTYPES, ('genres',)),
+            (args.ratings, RATINGS_DTYPES, ())]
+    for csv_path, dtypes, categorical in jobs:
+        if not os.path.exists(csv_path):
+            print(f"Skipping {csv_path}: file not found.")
+            continue
+        start = time.time()
+        directory = convert(csv_path, dtypes, categorical)
+        print(f"Converted {csv_path} in {time.time() - start:.1f}s. "
+              f"Saved to: {directory}")
+
+
+if __name__ == '__main__':
+    main()
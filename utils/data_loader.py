@@ -4,11 +4,443 @@
 
     Author: Explore Data Science Academy.
 
+    Description: Every dataset and model used by the app is loaded through
+    this module, so each artefact is read from disk once per process and
+    shared by all reruns and sessions. Cached artefacts are keyed on a
+    hash of the file contents, so replacing a file on disk invalidates
+    its cached copy.
+
+    When an up-to-date columnar copy of a dataset exists (see
+    `utils/columnar.py`) it is memory-mapped instead of parsing the .csv.
+
 """
 # Data handling dependencies
+import functools
+import hashlib
+import os
+import pickle
+import sys
+import threading
+
 import pandas as pd
 import numpy as np
 
+from utils.columnar import MANIFEST, columns_path, read_arrays, read_manifest
+from utils.genre_index import build_genre_index
+from utils.instrumentation import trace
+from utils import model_export
+from utils.popularity import (POPULARITY_PATH, build_popularity, rating_totals,
+                              read_rating_totals, save_popularity)
+from utils.title_index import TitleIndex
+
+MOVIES_PATH = 'resources/data/movies.csv'
+RATINGS_PATH = 'resources/data/ratings.csv'
+MODEL_PATH = 'resources/models/team2_SVD_recommender.pkl'
+
+MOVIES_DTYPES = {'movieId': np.int32, 'title': object, 'genres': object,
+                 'year': np.float32}
+RATINGS_DTYPES = {'userId': np.int32, 'movieId': np.int32,
+                  'rating': np.float32, 'timestamp': np.int64}
+
+_digests = {}
+_digest_lock = threading.Lock()
+
+
+def file_digest(path):
+    """Hash the contents of a file.
+
+    The digest is recomputed only when the size or modification time of
+    the file changes.
+
+    Parameters
+    ----------
+    path : str
+        Relative or absolute path to the file.
+
+    Returns
+    -------
+    str
+        Hex-encoded BLAKE2b digest of the file contents.
+
+    """
+    stat = os.stat(path)
+    key = (stat.st_size, stat.st_mtime_ns)
+    with _digest_lock:
+        cached = _digests.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    with _digest_lock:
+        _digests[path] = (key, digest.hexdigest())
+    return digest.hexdigest()
+
+
+def artefact_version(*paths):
+    """Combined digest of several artefacts, used to version derived results.
+
+    Parameters
+    ----------
+    *paths : str
+        Paths of the artefacts the result depends on. Missing files are
+        skipped.
+
+    Returns
+    -------
+    str
+        Hex-encoded digest.
+
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for path in paths:
+        if os.path.exists(path):
+            digest.update(file_digest(path).encode())
+    return digest.hexdigest()
+
+
+def resource_cache(func):
+    """Memoise a loader for the lifetime of the process.
+
+    Inside the Streamlit app the function is registered with Streamlit's
+    resource cache, so the returned objects are shared across reruns and
+    sessions. Elsewhere (training scripts, the command line) a plain
+    in-process memo is used, so Streamlit never needs to be imported.
+
+    Cached objects are shared, and must be treated as read-only.
+
+    """
+    st = sys.modules.get('streamlit')
+    cache = (getattr(st, 'cache_resource', None)
+             or getattr(st, 'experimental_singleton', None))
+    if cache is not None:
+        return cache(show_spinner=False)(func)
+    if st is not None and hasattr(st, 'cache'):
+        return st.cache(allow_output_mutation=True, show_spinner=False)(func)
+    return functools.lru_cache(maxsize=16)(func)
+
+
+@resource_cache
+def _read_movies(path, digest):
+    with trace('load_movies'):
+        return pd.read_csv(path, dtype=MOVIES_DTYPES)
+
+
+@resource_cache
+def _read_ratings(path, digest):
+    with trace('load_ratings'):
+        return pd.read_csv(path, dtype=RATINGS_DTYPES)
+
+
+@resource_cache
+def _read_columns(directory, digest):
+    with trace('load_columns'):
+        return read_arrays(directory, mmap_mode='r')
+
+
+@resource_cache
+def _read_frame(directory, digest):
+    # Without `copy=False` pandas consolidates the columns into new blocks,
+    # copying the memory-mapped data into every process
+    return pd.DataFrame(_read_columns(directory, digest), copy=False)
+
+
+def _frame_from_columns(directory):
+    return _read_frame(directory,
+                       file_digest(os.path.join(directory, MANIFEST)))
+
+
+@resource_cache
+def _read_pickle(path, digest):
+    with trace('load_model'), open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+@resource_cache
+def _read_npz(path, digest):
+    with trace('load_arrays'), np.load(path) as archive:
+        return {name: archive[name] for name in archive.files}
+
+
+def _columnar_copy(path):
+    """Columnar directory for `path` if it is up to date, otherwise None."""
+    directory = columns_path(path)
+    manifest = read_manifest(directory)
+    if manifest is None:
+        return None
+    if (os.path.exists(path)
+            and manifest['source_digest'] != file_digest(path)):
+        return None
+    return directory
+
+
+def load_movies(path=MOVIES_PATH):
+    """Load the movie database, parsing it at most once per process.
+
+    Parameters
+    ----------
+    path : str
+        Relative or absolute path to movie database stored
+        in .csv format.
+
+    Returns
+    -------
+    Pandas Dataframe
+        Shared, read-only movie records.
+
+    """
+    directory = _columnar_copy(path)
+    if directory is not None:
+        return _frame_from_columns(directory)
+    return _read_movies(path, file_digest(path))
+
+
+def load_ratings(path=RATINGS_PATH):
+    """Load user ratings, parsing them at most once per process.
+
+    Parameters
+    ----------
+    path : str
+        Relative or absolute path to ratings stored in .csv format.
+
+    Returns
+    -------
+    Pandas Dataframe
+        Shared, read-only rating records.
+
+    """
+    directory = _columnar_copy(path)
+    if directory is not None:
+        return _frame_from_columns(directory)
+    return _read_ratings(path, file_digest(path))
+
+
+def load_rating_arrays(path=RATINGS_PATH):
+    """Load user ratings as one array per column.
+
+    Unlike `load_ratings`, this skips building a Dataframe. When a
+    columnar copy of the data exists the arrays are memory-mapped, and
+    shared with every other process reading the same files.
+
+    Parameters
+    ----------
+    path : str
+        Relative or absolute path to ratings stored in .csv format.
+
+    Returns
+    -------
+    dict
+        Shared, read-only arrays keyed by column name.
+
+    """
+    directory = _columnar_copy(path)
+    if directory is not None:
+        return _read_columns(directory,
+                             file_digest(os.path.join(directory, MANIFEST)))
+    ratings = load_ratings(path)
+    return {name: ratings[name].to_numpy() for name in ratings.columns}
+
+
+def _source_digest(path):
+    """Digest identifying the data `load_rating_arrays(path)` would return."""
+    directory = _columnar_copy(path)
+    if directory is not None:
+        return file_digest(os.path.join(directory, MANIFEST))
+    return file_digest(path)
+
+
+@resource_cache
+def _build_rating_matrix(path, digest):
+    # Imported here so that scipy is only loaded by pages that need it
+    from utils.rating_matrix import build_rating_matrix, read_rating_matrix
+    with trace('build_rating_matrix'):
+        if _columnar_copy(path) is None:
+            # Stream the .csv rather than parsing it into a Dataframe
+            return read_rating_matrix(path)
+        ratings = load_rating_arrays(path)
+        return build_rating_matrix(ratings['userId'], ratings['movieId'],
+                                   ratings['rating'])
+
+
+def load_rating_matrix(path=RATINGS_PATH):
+    """Build the sparse user x item rating matrix, once per process.
+
+    Parameters
+    ----------
+    path : str
+        Relative or absolute path to ratings stored in .csv format.
+
+    Returns
+    -------
+    RatingMatrix
+        Shared, read-only matrix (see `utils/rating_matrix.py`).
+
+    """
+    return _build_rating_matrix(path, _source_digest(path))
+
+
+def load_model(path=MODEL_PATH):
+    """Unpickle a trained model, at most once per process.
+
+    Parameters
+    ----------
+    path : str
+        Relative or absolute path to the pickled model.
+
+    Returns
+    -------
+    object
+        Shared, read-only model instance.
+
+    """
+    return _read_pickle(path, file_digest(path))
+
+
+@resource_cache
+def _read_factors(directory, digest):
+    with trace('load_factors'):
+        return model_export.read_factors(directory, mmap_mode='r')
+
+
+def load_factors(path=MODEL_PATH):
+    """Load the compact export of a pickled model, if it is up to date.
+
+    Parameters
+    ----------
+    path : str
+        Relative or absolute path to the pickled model. Its export is
+        used if the model is missing or the export was made from it.
+
+    Returns
+    -------
+    dict or None
+        Shared, read-only memory-mapped factors (see
+        `utils/model_export.py`), or None if there is no usable export.
+
+    """
+    directory = model_export.factors_path(path)
+    manifest = model_export.read_manifest(directory)
+    if manifest is None:
+        return None
+    if os.path.exists(path) and manifest['source_digest'] != file_digest(path):
+        return None
+    return _read_factors(directory, file_digest(
+        os.path.join(directory, model_export.MANIFEST)))
+
+
+@resource_cache
+def _build_title_index(path, digest):
+    return TitleIndex(load_movies(path))
+
+
+def load_title_index(path=MOVIES_PATH):
+    """Build the title/row/movieId index of the catalogue, once per process.
+
+    Parameters
+    ----------
+    path : str
+        Relative or absolute path to movie database stored
+        in .csv format.
+
+    Returns
+    -------
+    TitleIndex
+        Shared, read-only index.
+
+    """
+    return _build_title_index(path, file_digest(path))
+
+
+@resource_cache
+def _build_genre_index(path, digest):
+    return build_genre_index(load_movies(path))
+
+
+def load_genre_index(path=MOVIES_PATH):
+    """Build the genre/year filtering index of the catalogue, once per process.
+
+    Parameters
+    ----------
+    path : str
+        Relative or absolute path to movie database stored
+        in .csv format.
+
+    Returns
+    -------
+    dict
+        Shared, read-only index (see `utils/genre_index.py`).
+
+    """
+    return _build_genre_index(path, file_digest(path))
+
+
+@resource_cache
+def _build_popularity(path, ratings_path, movies_path, digest):
+    with trace('build_popularity'):
+        if _columnar_copy(ratings_path) is None:
+            # Stream the .csv rather than parsing it into a Dataframe
+            totals = read_rating_totals(ratings_path)
+        else:
+            totals = rating_totals(load_rating_arrays(ratings_path))
+        popularity = build_popularity(totals, load_movies(movies_path))
+    popularity['source_digest'] = np.array(digest)
+    # Saved under a temporary name first, so a concurrent reader never
+    # sees a partial archive
+    temporary = f'{path}.{os.getpid()}.npz'
+    save_popularity(popularity, temporary)
+    os.replace(temporary, path)
+    return popularity
+
+
+def load_popularity(path=POPULARITY_PATH, ratings_path=RATINGS_PATH,
+                    movies_path=MOVIES_PATH):
+    """Load the popularity table, once per process.
+
+    The table saved by `python -m utils.popularity` is used if it was
+    built from the current ratings and movies, otherwise it is rebuilt
+    from them and saved.
+
+    Parameters
+    ----------
+    path : str
+        Relative or absolute path to the saved table.
+    ratings_path : str
+        Ratings the table is computed from.
+    movies_path : str
+        Movies the table is computed from.
+
+    Returns
+    -------
+    dict
+        Shared, read-only table (see `utils/popularity.py`).
+
+    """
+    digest = artefact_version(ratings_path, movies_path)
+    if os.path.exists(path):
+        popularity = load_arrays(path)
+        if str(popularity.get('source_digest')) == digest:
+            return popularity
+    return _build_popularity(path, ratings_path, movies_path, digest)
+
+
+def load_arrays(path):
+    """Load the arrays of an `.npz` archive, at most once per process.
+
+    Parameters
+    ----------
+    path : str
+        Relative or absolute path to the archive.
+
+    Returns
+    -------
+    dict
+        Shared, read-only arrays keyed by name.
+
+    """
+    return _read_npz(path, file_digest(path))
+
+
 def load_movie_titles(path_to_movies):
     """Load movie titles from database records.
 
@@ -24,7 +456,5 @@ def load_movie_titles(path_to_movies):
         Movie titles.
 
     """
-    df = pd.read_csv(path_to_movies)
-    df = df.dropna()
-    movie_list = df['title'].to_list()
+    movie_list = load_title_index(path_to_movies).listed_titles()
     return movie_list
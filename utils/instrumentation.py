@@ -0,0 +1,167 @@
+"""
+
+    Opt-in timing instrumentation for the recommendation pipeline.
+
+    Author: Explore Data Science Academy.
+
+    Description: Stages of the pipeline are wrapped in `span`s, and each
+    recommendation request in a `trace` collecting the spans run while it
+    was active. When a trace finishes it is logged as one JSON line on the
+    `recommender.metrics` logger and kept as the last trace. Counters
+    tally events such as cache hits.
+
+    Instrumentation is off by default, in which case spans and traces do
+    nothing. Enable it for the whole process with `enable()`, or by
+    setting the `RECOMMENDER_INSTRUMENTATION` environment variable; set
+    `RECOMMENDER_METRICS_LOG` to also append the JSON lines to a file.
+    `collect` instead enables it for the requests made in one context,
+    e.g. one app session, and hands their traces to that context only.
+
+"""
+# Script dependencies
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+
+logger = logging.getLogger('recommender.metrics')
+
+_enabled = bool(os.environ.get('RECOMMENDER_INSTRUMENTATION'))
+_current = contextvars.ContextVar('recommender_trace', default=None)
+_sink = contextvars.ContextVar('recommender_trace_sink', default=None)
+_counters = Counter()
+_lock = threading.Lock()
+_last_trace = None
+
+if os.environ.get('RECOMMENDER_METRICS_LOG'):
+    logger.addHandler(logging.FileHandler(os.environ['RECOMMENDER_METRICS_LOG']))
+    logger.setLevel(logging.INFO)
+
+
+class Trace:
+    """Timings of the stages run while handling one request."""
+
+    def __init__(self, name):
+        self.name = name
+        self.spans = []
+        self.total_ms = None
+        self._depth = 0
+
+    def as_dict(self):
+        return {'trace': self.name, 'total_ms': self.total_ms,
+                'spans': [{'name': name, 'depth': depth, 'ms': ms}
+                          for name, depth, ms in self.spans]}
+
+
+def enable(on=True):
+    """Turn instrumentation on (or off) for the whole process."""
+    global _enabled
+    _enabled = on
+
+
+def enabled():
+    """Whether requests made in the current context are instrumented."""
+    return _enabled or _sink.get() is not None
+
+
+@contextlib.contextmanager
+def collect(sink):
+    """Instrument the requests made within the block, whatever `enabled`.
+
+    The setting is held in a context variable, so it only applies to the
+    current thread, and to work submitted from it with a copy of its
+    context (see `utils.background.submit`).
+
+    Parameters
+    ----------
+    sink : callable
+        Called with each `Trace` finished in the block's context.
+
+    """
+    token = _sink.set(sink)
+    try:
+        yield
+    finally:
+        _sink.reset(token)
+
+
+def increment(name, amount=1):
+    """Add to a named counter."""
+    if enabled():
+        with _lock:
+            _counters[name] += amount
+
+
+def counters():
+    """Snapshot of all counters."""
+    with _lock:
+        return dict(_counters)
+
+
+def last_trace():
+    """The most recently finished trace of the process, or None."""
+    return _last_trace
+
+
+@contextlib.contextmanager
+def trace(name):
+    """Collect the spans of one request and log them when it finishes.
+
+    A trace started while another is active is recorded as a span of the
+    outer trace instead.
+
+    """
+    if not enabled() or _current.get() is not None:
+        with span(name):
+            yield
+        return
+    global _last_trace
+    sink = _sink.get()
+    current = Trace(name)
+    token = _current.set(current)
+    start = time.perf_counter()
+    try:
+        yield current
+    finally:
+        current.total_ms = 1000 * (time.perf_counter() - start)
+        _current.reset(token)
+        _last_trace = current
+        increment(f'{name}.requests')
+        logger.info(json.dumps(current.as_dict()))
+        if sink is not None:
+            sink(current)
+
+
+@contextlib.contextmanager
+def span(name):
+    """Time a stage of the active trace. Does nothing outside a trace."""
+    # A trace is only active while instrumentation is enabled
+    current = _current.get()
+    if current is None:
+        yield
+        return
+    record = [name, current._depth, None]
+    current.spans.append(record)
+    current._depth += 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record[2] = 1000 * (time.perf_counter() - start)
+        current._depth -= 1
+
+
+def timed(name):
+    """Decorator running a function inside a `span`."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
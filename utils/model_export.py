@@ -0,0 +1,132 @@
+"""
+
+    Compact export of trained SVD models.
+
+    Author: Explore Data Science Academy.
+
+    Description: A pickled surprise `SVD` carries its whole trainset and
+    float64 factors, and must be unpickled in full by every process that
+    uses it. The collaborative recommender only needs the factor
+    matrices, the biases and the raw ids of the factor rows, so these are
+    exported to a directory of float32/int32 `.npy` files which are
+    memory-mapped read-only when loaded: loading is near-instant, and
+    every app process shares the same page-cached copy.
+
+    A `factors.json` manifest records the format version, the scalars of
+    the model (global mean, rating scale) and a digest of the pickle the
+    factors were exported from, so stale exports can be detected.
+
+    Usage (from the root of the repository):
+
+        python -m utils.model_export
+
+"""
+# Data handling dependencies
+import argparse
+import json
+import os
+import pickle
+
+import numpy as np
+
+MANIFEST = 'factors.json'
+FORMAT_VERSION = 1
+ARRAYS = {'user_factors': np.float32, 'item_factors': np.float32,
+          'user_biases': np.float32, 'item_biases': np.float32,
+          'user_ids': np.int32, 'item_ids': np.int32}
+
+
+def factors_path(model_path):
+    """Directory holding the exported factors of a pickled model."""
+    return os.path.splitext(model_path)[0] + '.factors'
+
+
+def export_factors(model, directory, source_digest=None):
+    """Write the factors, biases and id maps of a trained SVD model.
+
+    Parameters
+    ----------
+    model : surprise.SVD
+        Trained model.
+    directory : str
+        Output directory, created if needed.
+    source_digest : str, optional
+        Digest of the pickle the model was loaded from or saved to.
+
+    """
+    trainset = model.trainset
+    n_users, n_items = len(model.pu), len(model.qi)
+    arrays = {'user_factors': model.pu, 'item_factors': model.qi,
+              'user_biases': model.bu if model.biased else np.zeros(n_users),
+              'item_biases': model.bi if model.biased else np.zeros(n_items),
+              'user_ids': [trainset.to_raw_uid(u) for u in range(n_users)],
+              'item_ids': [trainset.to_raw_iid(i) for i in range(n_items)]}
+    os.makedirs(directory, exist_ok=True)
+    for name, dtype in ARRAYS.items():
+        np.save(os.path.join(directory, f'{name}.npy'),
+                np.asarray(arrays[name], dtype=dtype))
+    manifest = {'version': FORMAT_VERSION,
+                'n_users': n_users, 'n_items': n_items,
+                'n_factors': int(model.n_factors),
+                'global_mean': float(trainset.global_mean) if model.biased else 0.0,
+                'rating_scale': [float(v) for v in trainset.rating_scale],
+                'source_digest': source_digest}
+    # The manifest is written last, so a partial export is never read
+    with open(os.path.join(directory, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+
+def read_manifest(directory):
+    """Read the manifest of an export, or None if absent or outdated."""
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    if manifest.get('version') != FORMAT_VERSION:
+        return None
+    return manifest
+
+
+def read_factors(directory, mmap_mode='r'):
+    """Load an export written by `export_factors`.
+
+    Parameters
+    ----------
+    directory : str
+        Export directory.
+    mmap_mode : str, optional
+        Memory-map mode of the arrays; None reads them into memory.
+
+    Returns
+    -------
+    dict
+        The arrays of `ARRAYS`, plus `global_mean` and `rating_scale`.
+
+    """
+    manifest = read_manifest(directory)
+    factors = {name: np.load(os.path.join(directory, f'{name}.npy'),
+                             mmap_mode=mmap_mode)
+               for name in ARRAYS}
+    factors['global_mean'] = manifest['global_mean']
+    factors['rating_scale'] = tuple(manifest['rating_scale'])
+    return factors
+
+
+def main():
+    from utils.data_loader import MODEL_PATH, file_digest
+    parser = argparse.ArgumentParser(description=__doc__.split('Usage')[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default=MODEL_PATH)
+    args = parser.parse_args()
+
+    with open(args.model, 'rb') as f:
+        model = pickle.load(f)
+    directory = factors_path(args.model)
+    export_factors(model, directory, source_digest=file_digest(args.model))
+    print(f"Exported {len(model.pu)} users and {len(model.qi)} items "
+          f"to: {directory}")
+
+
+if __name__ == '__main__':
+    main()
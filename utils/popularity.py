@@ -0,0 +1,244 @@
+"""
+
+    Popularity baseline for cold-start and fallback recommendations.
+
+    Author: Explore Data Science Academy.
+
+    Description: Computes, in one streamed pass over the ratings, the
+    number of ratings and the Bayesian-average rating of every movie: its
+    mean rating shrunk towards the global mean by `PRIOR_COUNT` virtual
+    ratings, so that a movie with a single 5-star rating does not outrank
+    one with thousands of 4.5-star ratings. Movies are then ranked by that
+    score overall, within each genre and within each decade.
+
+    The recommenders use the table to answer when the chosen movies are
+    unknown to their model, and to limit the movies they score to the
+    most popular ones. The saved table records a digest of the ratings
+    and movies it was built from, so a stale table can be detected.
+
+    Usage (from the root of the repository):
+
+        python -m utils.popularity
+
+"""
+# Data handling dependencies
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils.genre_index import GENRE_BITS, GENRES, genre_masks
+
+POPULARITY_PATH = 'resources/models/popularity.npz'
+# Virtual ratings at the global mean added to every movie
+PRIOR_COUNT = 10
+# Length of each per-genre and per-decade top list
+TOP_LIST_SIZE = 100
+
+
+def rating_totals(ratings, minlength=0):
+    """Number and sum of the ratings of each movie.
+
+    Parameters
+    ----------
+    ratings : dict or Pandas Dataframe
+        `movieId` and `rating` of every rating.
+    minlength : int
+        Minimum length of the returned arrays.
+
+    Returns
+    -------
+    tuple (numpy.ndarray, numpy.ndarray)
+        Rating counts and sums, indexed by MovieLens Movie ID.
+
+    """
+    movie_ids = np.asarray(ratings['movieId'])
+    return (np.bincount(movie_ids, minlength=minlength),
+            np.bincount(movie_ids, weights=np.asarray(ratings['rating']),
+                        minlength=minlength))
+
+
+def read_rating_totals(path, chunk_size=1000000):
+    """Compute `rating_totals` by streaming a ratings .csv.
+
+    Only the `movieId` and `rating` columns are parsed, `chunk_size` rows
+    at a time, so memory use does not grow with the number of ratings.
+
+    """
+    counts, sums = np.zeros(0, dtype=np.int64), np.zeros(0)
+    chunks = pd.read_csv(path, usecols=['movieId', 'rating'],
+                         dtype={'movieId': np.int32, 'rating': np.float32},
+                         chunksize=chunk_size)
+    for chunk in chunks:
+        chunk_counts, chunk_sums = rating_totals(chunk, len(counts))
+        # A chunk may hold larger ids than any seen before
+        grow = len(chunk_counts) - len(counts)
+        counts = np.pad(counts, (0, grow)) + chunk_counts
+        sums = np.pad(sums, (0, grow)) + chunk_sums
+    return counts, sums
+
+
+def build_popularity(totals, movies, prior_count=PRIOR_COUNT,
+                     top_list_size=TOP_LIST_SIZE):
+    """Compute popularity statistics and top lists of the rated movies.
+
+    Parameters
+    ----------
+    totals : tuple (numpy.ndarray, numpy.ndarray)
+        Rating counts and sums by movie, from `rating_totals` or
+        `read_rating_totals`.
+    movies : Pandas Dataframe
+        Movie records with `movieId`, `genres` and `year` columns.
+    prior_count : int
+        Weight of the global mean in the Bayesian average, in ratings.
+    top_list_size : int
+        Movies kept in each genre and decade top list.
+
+    Returns
+    -------
+    dict
+        `movie_ids` (sorted), their rating `counts`, `means` and
+        Bayesian-average `scores`; `ranking`: every rated movie, best
+        first (leaving out movies missing from `movies`); and
+        `genre_<genre>` and `decade_<decade>` top lists.
+
+    """
+    counts, sums = totals
+    movie_ids = np.flatnonzero(counts).astype(np.int32)
+    counts = counts[movie_ids]
+    sums = np.asarray(sums, dtype=np.float64)[movie_ids]
+    global_mean = sums.sum() / max(counts.sum(), 1)
+    scores = (sums + prior_count * global_mean) / (counts + prior_count)
+    order = np.lexsort((-counts, -scores))
+    ranking = movie_ids[order]
+    # Genres and decades of the ranked movies, in ranking order
+    rows = pd.Index(movies['movieId']).get_indexer(ranking)
+    ranking, rows = ranking[rows >= 0], rows[rows >= 0]
+    popularity = {'movie_ids': movie_ids,
+                  'counts': counts.astype(np.int32),
+                  'means': (sums / counts).astype(np.float32),
+                  'scores': scores.astype(np.float32),
+                  'ranking': ranking}
+    masks = genre_masks(movies)[rows]
+    for genre in GENRES:
+        in_genre = (masks & GENRE_BITS[genre]) != 0
+        popularity[f'genre_{genre}'] = ranking[in_genre][:top_list_size]
+    decades = movies['year'].to_numpy()[rows] // 10 * 10
+    for decade in np.unique(decades[~np.isnan(decades)]):
+        popularity[f'decade_{int(decade)}'] = ranking[decades == decade][:top_list_size]
+    return popularity
+
+
+def save_popularity(popularity, path=POPULARITY_PATH, source_digest=None):
+    """Write a popularity table to an uncompressed `.npz` archive.
+
+    Parameters
+    ----------
+    popularity : dict
+        Table built by `build_popularity`.
+    path : str
+        Location of the `.npz` archive.
+    source_digest : str, optional
+        Digest of the ratings and movies the table was built from (see
+        `utils.data_loader.artefact_version`), stored so that a stale
+        table can be detected.
+
+    """
+    if source_digest is not None:
+        popularity = {**popularity, 'source_digest': np.array(source_digest)}
+    np.savez(path, **popularity)
+
+
+def popular_movies(popularity, top_n=10, genres=(), exclude=()):
+    """Most popular movies, optionally within the given genres.
+
+    Parameters
+    ----------
+    popularity : dict
+        Table built by `build_popularity`.
+    top_n : int
+        Number of movies to return.
+    genres : list (str)
+        If given, movies from the top lists of these genres are returned,
+        best first, before any others.
+    exclude : array-like (int)
+        MovieLens Movie IDs never to return.
+
+    Returns
+    -------
+    numpy.ndarray
+        Up to `top_n` MovieLens Movie IDs, best first.
+
+    """
+    lists = [popularity[f'genre_{g}'] for g in genres if f'genre_{g}' in popularity]
+    candidates = popularity['ranking'][:top_n + len(exclude)]
+    if lists:
+        in_genres = np.unique(np.concatenate(lists))
+        positions = np.searchsorted(popularity['movie_ids'], in_genres)
+        best = in_genres[np.argsort(-popularity['scores'][positions], kind='stable')]
+        candidates = np.concatenate([best, candidates])
+    candidates = pd.unique(candidates)
+    return candidates[~np.isin(candidates, exclude)][:top_n]
+
+
+def fill_with_popular(popularity, top_ids, top_n=10, genres=(), exclude=()):
+    """Pad a short list of recommendations with popular movies.
+
+    Parameters
+    ----------
+    popularity : dict
+        Table built by `build_popularity`.
+    top_ids : numpy.ndarray (int)
+        MovieLens Movie IDs recommended so far, best first.
+    top_n : int
+        Number of movies wanted.
+    genres : list (str)
+        Genres whose popular movies are preferred.
+    exclude : array-like (int)
+        MovieLens Movie IDs never to add, e.g. the chosen movies.
+
+    Returns
+    -------
+    numpy.ndarray
+        `top_ids` followed by up to `top_n - len(top_ids)` popular movies.
+
+    """
+    if len(top_ids) >= top_n:
+        return top_ids
+    exclude = np.concatenate([np.asarray(exclude, dtype=np.int32),
+                              np.asarray(top_ids, dtype=np.int32)])
+    fill = popular_movies(popularity, top_n - len(top_ids), genres, exclude)
+    return np.concatenate([np.asarray(top_ids, dtype=np.int32), fill])
+
+
+def genres_of(movies, rows):
+    """Distinct genres of the movies at the given catalogue rows."""
+    # Only the selected rows are converted from the categorical column
+    genres = movies['genres'].iloc[rows].astype(object).dropna()
+    return sorted(set(' '.join(genres).split()))
+
+
+def main():
+    from utils.data_loader import (MOVIES_PATH, RATINGS_PATH, artefact_version,
+                                   load_movies)
+    parser = argparse.ArgumentParser(description=__doc__.split('Usage')[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ratings', default=RATINGS_PATH)
+    parser.add_argument('--movies', default=MOVIES_PATH)
+    parser.add_argument('--output', default=POPULARITY_PATH)
+    parser.add_argument('--prior-count', type=int, default=PRIOR_COUNT,
+                        help='Virtual ratings at the global mean per movie.')
+    args = parser.parse_args()
+
+    start = time.time()
+    popularity = build_popularity(read_rating_totals(args.ratings),
+                                  load_movies(args.movies), args.prior_count)
+    save_popularity(popularity, args.output,
+                    source_digest=artefact_version(args.ratings, args.movies))
+    print(f"Ranked {len(popularity['movie_ids'])} movies in "
+          f"{time.time() - start:.1f}s. Saved to: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
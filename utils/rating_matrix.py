@@ -0,0 +1,164 @@
+"""
+
+    Sparse user-item rating matrix.
+
+    Author: Explore Data Science Academy.
+
+    Description: Holds every rating in a `scipy.sparse` CSR matrix with one
+    row per user and one column per movie, alongside the sorted MovieLens
+    ids each row and column corresponds to. A user's ratings are then a
+    row slice, and item-item similarities are sparse dot products.
+
+    `read_rating_matrix` builds the matrix straight from a ratings .csv,
+    a chunk of rows at a time, so the ratings are never held in a
+    Dataframe.
+
+"""
+# Data handling dependencies
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+RatingMatrix = namedtuple('RatingMatrix', ['matrix', 'user_ids', 'item_ids'])
+RatingMatrix.__doc__ = """CSR ratings plus the ids of its rows and columns."""
+
+
+def build_rating_matrix(user_ids, item_ids, ratings):
+    """Build a CSR user x item rating matrix from rating records.
+
+    Parameters
+    ----------
+    user_ids : array-like (int)
+        MovieLens User ID of each rating.
+    item_ids : array-like (int)
+        MovieLens Movie ID of each rating.
+    ratings : array-like (float)
+        Rating values.
+
+    Returns
+    -------
+    RatingMatrix
+        float32 CSR matrix of shape (n_users, n_items) with the sorted,
+        unique user and movie ids of its rows and columns.
+
+    """
+    users, rows = np.unique(np.asarray(user_ids), return_inverse=True)
+    items, columns = np.unique(np.asarray(item_ids), return_inverse=True)
+    matrix = sparse.csr_matrix(
+        (np.asarray(ratings, dtype=np.float32), (rows, columns)),
+        shape=(len(users), len(items)))
+    return RatingMatrix(matrix, users.astype(np.int32), items.astype(np.int32))
+
+
+class _IdMap:
+    """Incremental mapping of raw ids to dense indices, in order of arrival."""
+
+    def __init__(self):
+        self._lookup = np.full(0, -1, dtype=np.int32)
+        self.ids = np.array([], dtype=np.int32)
+
+    def add(self, raw_ids):
+        """Dense indices of the raw ids, registering ids not seen before."""
+        if len(raw_ids) and raw_ids.max() >= len(self._lookup):
+            grown = np.full(max(raw_ids.max() + 1, 2 * len(self._lookup)), -1,
+                            dtype=np.int32)
+            grown[:len(self._lookup)] = self._lookup
+            self._lookup = grown
+        new_ids = pd.unique(raw_ids[self._lookup[raw_ids] < 0])
+        self._lookup[new_ids] = np.arange(len(self.ids),
+                                          len(self.ids) + len(new_ids))
+        self.ids = np.concatenate([self.ids, new_ids.astype(np.int32)])
+        return self._lookup[raw_ids]
+
+    def sorted_order(self):
+        """Sorted ids, and the new position of each dense index."""
+        order = np.argsort(self.ids, kind='stable')
+        positions = np.empty(len(order), dtype=np.int32)
+        positions[order] = np.arange(len(order), dtype=np.int32)
+        return self.ids[order], positions
+
+
+def read_rating_matrix(path, chunk_size=1000000):
+    """Build a CSR user x item rating matrix by streaming a ratings .csv.
+
+    Only the `userId`, `movieId` and `rating` columns are parsed, with
+    compact dtypes, `chunk_size` rows at a time. Each chunk is reduced to
+    int32 row/column indices and float32 values as it is read, so peak
+    memory is about 12 bytes per rating plus the final matrix.
+
+    Parameters
+    ----------
+    path : str
+        Relative or absolute path to ratings stored in .csv format.
+    chunk_size : int
+        Number of rows parsed at once.
+
+    Returns
+    -------
+    RatingMatrix
+        The same matrix `build_rating_matrix` returns for these ratings.
+
+    """
+    users, items = _IdMap(), _IdMap()
+    rows, columns, values = [], [], []
+    chunks = pd.read_csv(path, usecols=['userId', 'movieId', 'rating'],
+                         dtype={'userId': np.int32, 'movieId': np.int32,
+                                'rating': np.float32},
+                         chunksize=chunk_size)
+    for chunk in chunks:
+        rows.append(users.add(chunk['userId'].to_numpy()))
+        columns.append(items.add(chunk['movieId'].to_numpy()))
+        values.append(chunk['rating'].to_numpy())
+    # Renumber rows and columns in id order, as `build_rating_matrix` does
+    user_ids, user_positions = users.sorted_order()
+    item_ids, item_positions = items.sorted_order()
+    rows = user_positions[np.concatenate(rows or [[]]).astype(np.int32)]
+    columns = item_positions[np.concatenate(columns or [[]]).astype(np.int32)]
+    values = np.concatenate(values or [[]]).astype(np.float32, copy=False)
+    matrix = sparse.csr_matrix((values, (rows, columns)),
+                               shape=(len(user_ids), len(item_ids)))
+    return RatingMatrix(matrix, user_ids, item_ids)
+
+
+def _positions(sorted_ids, ids):
+    ids = np.asarray(ids)
+    positions = np.searchsorted(sorted_ids, ids)
+    positions = np.minimum(positions, len(sorted_ids) - 1)
+    found = sorted_ids[positions] == ids
+    return positions[found]
+
+
+def user_rows(rating_matrix, user_ids):
+    """Matrix rows of the given users, skipping users without ratings."""
+    return _positions(rating_matrix.user_ids, user_ids)
+
+
+def item_columns(rating_matrix, item_ids):
+    """Matrix columns of the given movies, skipping movies without ratings."""
+    return _positions(rating_matrix.item_ids, item_ids)
+
+
+def item_similarity(ratings, columns):
+    """Cosine similarity between some items and every item.
+
+    Parameters
+    ----------
+    ratings : scipy.sparse.csr_matrix
+        User x item ratings the similarity is computed over.
+    columns : array-like (int)
+        Columns of the items to compare against all others.
+
+    Returns
+    -------
+    numpy.ndarray
+        Similarities of shape (len(columns), n_items).
+
+    """
+    ratings_t = ratings.T.tocsr()
+    norms = np.sqrt(np.asarray(ratings.multiply(ratings).sum(axis=0))).ravel()
+    dots = (ratings_t[columns] @ ratings).toarray()
+    denominator = np.outer(norms[columns], norms)
+    return np.divide(dots, denominator, out=np.zeros_like(dots),
+                     where=denominator > 0)
@@ -0,0 +1,256 @@
+"""
+
+    Request-level cache of recommendation results.
+
+    Author: Explore Data Science Academy.
+
+    Description: Many app users pick the same favourite movies, so the
+    results of the recommenders are cached per process, keyed on the
+    algorithm, the (order-insensitive) set of chosen titles and `top_n`.
+    The cache is bounded with least-recently-used eviction, entries can
+    expire after a time-to-live, and an algorithm's entries are dropped
+    whenever the version of the model or data they were computed from
+    changes. Setting the `RECOMMENDATION_CACHE_PATH` environment variable
+    persists the cache to disk between restarts, and
+    `RECOMMENDATION_CACHE_TTL` sets the time-to-live in seconds.
+
+    New entries are written to disk in the background at most every
+    `RECOMMENDATION_CACHE_SAVE_INTERVAL` seconds (60 by default), and when
+    the process exits. Several processes may share the file: each save
+    merges the entries already on disk with the process's own, so no
+    process overwrites what the others have added.
+
+"""
+# Data handling dependencies
+import atexit
+import functools
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from utils.data_loader import artefact_version
+from utils.instrumentation import increment, span, trace
+
+
+class ResultCache:
+    """Thread-safe LRU cache with optional TTL and disk persistence.
+
+    Parameters
+    ----------
+    max_size : int
+        Maximum number of entries kept; the least recently used entry is
+        evicted first.
+    ttl : float, optional
+        Seconds after which an entry expires. Entries never expire if None.
+    path : str, optional
+        File the cache is loaded from, and merged into by `save`.
+    save_interval : float
+        Seconds after an insert before the cache is saved to `path`. It
+        is also saved when the process exits.
+
+    """
+
+    def __init__(self, max_size=1024, ttl=None, path=None, save_interval=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.save_interval = save_interval
+        self.versions = {}
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._timer = None
+        if path is not None:
+            self.versions, self._entries = self._merge(*self._read())
+            atexit.register(self.save)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def validate(self, namespace, version):
+        """Drop a namespace's entries if they were filled from another version.
+
+        Keys are tuples whose first element is their namespace, e.g. the
+        name of the algorithm that produced the value.
+
+        """
+        with self._lock:
+            if self.versions.get(namespace) == version:
+                return
+            for key in [k for k in self._entries if k[0] == namespace]:
+                del self._entries[key]
+            self.versions[namespace] = version
+
+    def get(self, key):
+        """Look up a key.
+
+        Returns
+        -------
+        tuple (bool, object)
+            Whether the key was found, and its value (None on a miss).
+
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None \
+                    and time.time() - entry[0] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[1]
+
+    def put(self, key, value):
+        """Insert a value, evicting the least recently used entries."""
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            # Inserts are batched into one save per interval
+            if self.path is not None and self._timer is None:
+                self._timer = threading.Timer(self.save_interval, self.save)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def clear(self):
+        """Remove every entry and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        """Hit/miss counters and current size."""
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self._entries), 'max_size': self.max_size}
+
+    def save(self):
+        """Merge the cache into the file at `path`, and reload the result.
+
+        Entries other processes have saved since the cache was loaded are
+        kept, and picked up by this process too; when both hold an entry
+        for the same key, the newer one wins.
+
+        """
+        if self.path is None:
+            return
+        with self._save_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+            versions, entries = self._merge(*self._read())
+            # Write to a temporary file first, so a crash never leaves a
+            # truncated cache behind
+            temporary = f'{self.path}.{os.getpid()}.tmp'
+            with open(temporary, 'wb') as f:
+                pickle.dump((versions, entries), f)
+            os.replace(temporary, self.path)
+            with self._lock:
+                # Entries inserted while saving are kept for the next save
+                for key, entry in self._entries.items():
+                    if entry[0] > entries.get(key, (0,))[0]:
+                        entries[key] = entry
+                        entries.move_to_end(key)
+                while len(entries) > self.max_size:
+                    entries.popitem(last=False)
+                self.versions, self._entries = versions, entries
+
+    def _read(self):
+        """Versions and entries saved at `path`, or empty ones."""
+        try:
+            with open(self.path, 'rb') as f:
+                return pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return {}, OrderedDict()
+
+    def _merge(self, versions, entries):
+        """Combine saved versions and entries with this cache's own."""
+        with self._lock:
+            own_versions, own_entries = dict(self.versions), OrderedDict(self._entries)
+        # A namespace validated here drops saved entries of other versions
+        merged_versions = {**versions, **own_versions}
+        merged = {key: entry for key, entry in entries.items()
+                  if merged_versions.get(key[0]) == versions.get(key[0])}
+        for key, entry in own_entries.items():
+            if entry[0] >= merged.get(key, (0,))[0]:
+                merged[key] = entry
+        if self.ttl is not None:
+            now = time.time()
+            merged = {key: entry for key, entry in merged.items()
+                      if now - entry[0] <= self.ttl}
+        # The most recently inserted entries are kept, least recent first
+        newest = sorted(merged.items(), key=lambda item: item[1][0])
+        return merged_versions, OrderedDict(newest[-self.max_size:])
+
+
+# Shared by every Streamlit session served by this process
+recommendation_cache = ResultCache(
+    ttl=float(os.environ['RECOMMENDATION_CACHE_TTL'])
+    if 'RECOMMENDATION_CACHE_TTL' in os.environ else None,
+    path=os.environ.get('RECOMMENDATION_CACHE_PATH'),
+    save_interval=float(os.environ.get('RECOMMENDATION_CACHE_SAVE_INTERVAL', 60)))
+
+
+def cache_key(algorithm, movie_list, top_n):
+    """Key of a result; the order of the chosen titles does not matter."""
+    return (algorithm, frozenset(movie_list), top_n)
+
+
+def cached_recommendations(algorithm, artefact_paths, cache=recommendation_cache):
+    """Cache the results of a `*_model(movie_list, top_n)` function.
+
+    Parameters
+    ----------
+    algorithm : str
+        Name distinguishing this recommender's entries in the cache.
+    artefact_paths : list (str)
+        Model and data files the results depend on. Cached results are
+        dropped when any of them changes.
+    cache : ResultCache
+        Cache to use.
+
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(movie_list, top_n=10):
+            with trace(func.__name__):
+                with span('cache_lookup'):
+                    cache.validate(algorithm, artefact_version(*artefact_paths))
+                    key = cache_key(algorithm, movie_list, top_n)
+                    found, value = cache.get(key)
+                increment(f'{algorithm}.cache_{"hits" if found else "misses"}')
+                if not found:
+                    value = func(movie_list, top_n)
+                    cache.put(key, value)
+                return list(value)
+
+        def prime(movie_list, top_n, value):
+            """Store a result computed elsewhere, e.g. by a batch job."""
+            cache.validate(algorithm, artefact_version(*artefact_paths))
+            cache.put(cache_key(algorithm, movie_list, top_n), list(value))
+
+        def lookup(movie_list, top_n=10):
+            """Cached result, without computing it on a miss.
+
+            Returns
+            -------
+            tuple (bool, list)
+                Whether a result was cached, and the result.
+
+            """
+            cache.validate(algorithm, artefact_version(*artefact_paths))
+            found, value = cache.get(cache_key(algorithm, movie_list, top_n))
+            return found, list(value) if found else None
+
+        wrapper.prime = prime
+        wrapper.lookup = lookup
+        return wrapper
+    return decorator
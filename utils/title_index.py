@@ -0,0 +1,83 @@
+"""
+
+    Title, row and MovieLens id lookups for the movie catalogue.
+
+    Author: Explore Data Science Academy.
+
+    Description: Resolving a title by scanning the `title` column, or
+    materialising a result with `list(movies['title'])[i]`, costs a full
+    pass over the catalogue per movie. `TitleIndex` is built once and maps
+    between titles, catalogue rows and MovieLens ids with hash lookups.
+
+    Several movies share a title (e.g. remakes released in the same year),
+    so a title resolves to every movie carrying it.
+
+"""
+# Data handling dependencies
+import numpy as np
+import pandas as pd
+
+
+class TitleIndex:
+    """Bidirectional title <-> row <-> movieId index over a movies table.
+
+    Parameters
+    ----------
+    movies : Pandas Dataframe
+        Movie records with `movieId` and `title` columns. Rows are numbered
+        in the order of the records.
+
+    """
+
+    def __init__(self, movies):
+        self.titles = movies['title'].to_numpy(dtype=object)
+        self.movie_ids = movies['movieId'].to_numpy(dtype=np.int32)
+        # Rows without missing fields, as listed by the app
+        self.complete = movies.notna().all(axis=1).to_numpy()
+        self._rows_by_title = pd.Series(self.titles).groupby(self.titles).indices
+        self._rows_by_id = pd.Index(self.movie_ids)
+
+    def __len__(self):
+        return len(self.titles)
+
+    def __contains__(self, title):
+        return title in self._rows_by_title
+
+    def rows(self, titles):
+        """Rows of every movie carrying one of the titles.
+
+        Unknown titles are skipped.
+
+        """
+        found = [self._rows_by_title[t] for t in titles
+                 if t in self._rows_by_title]
+        if not found:
+            return np.array([], dtype=np.int64)
+        return np.concatenate(found)
+
+    def ids(self, titles):
+        """MovieLens ids of every movie carrying one of the titles."""
+        return self.movie_ids[self.rows(titles)]
+
+    def rows_of_ids(self, movie_ids):
+        """Rows of the given MovieLens ids, with -1 for unknown ids."""
+        return self._rows_by_id.get_indexer(np.asarray(movie_ids))
+
+    def titles_of_ids(self, movie_ids):
+        """Titles of the given MovieLens ids.
+
+        Raises
+        ------
+        KeyError
+            If any of the ids is not in the catalogue.
+
+        """
+        rows = self.rows_of_ids(movie_ids)
+        if (rows < 0).any():
+            unknown = np.asarray(movie_ids)[rows < 0]
+            raise KeyError(f'Movie ids not in the catalogue: {unknown.tolist()}')
+        return list(self.titles[rows])
+
+    def listed_titles(self):
+        """Titles of complete records, in catalogue order."""
+        return self.titles[self.complete].tolist()